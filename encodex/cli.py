@@ -36,6 +36,14 @@ def run_single_node(args):
         if hasattr(args, "use_gpu") and args.use_gpu:  # Check if arg exists and is True
             node_kwargs["use_gpu"] = True
             # print("CLI flag --use-gpu detected.") # Optional: Add confirmation
+        if getattr(args, "jobs", None):
+            node_kwargs["jobs"] = args.jobs
+        if getattr(args, "psnr_prefilter", False):
+            node_kwargs["psnr_prefilter"] = True
+        if getattr(args, "full_segments", False):
+            node_kwargs["full_segments"] = True
+        if getattr(args, "fused_metrics", False):
+            node_kwargs["fused_metrics"] = True
 
         # Run the node, passing potential node-specific arguments
         updated_state = run_node(node_name, input_state, input_file, **node_kwargs)
@@ -100,7 +108,13 @@ def run_full_workflow(args):
 
         # Create and run the workflow
         # Pass use_gpu flag to graph creation
-        workflow = create_graph(use_gpu=use_gpu)
+        workflow = create_graph(
+            use_gpu=use_gpu,
+            jobs=args.jobs,
+            psnr_prefilter=args.psnr_prefilter,
+            full_segments=args.full_segments,
+            fused_metrics=args.fused_metrics,
+        )
         # Convert initial state object to dict for LangGraph invocation
         initial_state_dict = initial_state.model_dump(exclude_unset=True)
         # Invoke the workflow with the state dictionary directly
@@ -318,6 +332,27 @@ def main():
         action="store_true",  # Makes it a boolean flag
         help="Attempt to use GPU for encoding (if applicable to the node, e.g., low_res_encoder)",
     )
+    node_parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="Number of concurrent FFmpeg jobs for test encodings and quality metrics (default: based on usable CPUs)",
+    )
+    node_parser.add_argument(
+        "--psnr-prefilter",
+        action="store_true",
+        help="Measure PSNR first and skip VMAF for test encodings dominated by a lower bitrate",
+    )
+    node_parser.add_argument(
+        "--full-segments",
+        action="store_true",
+        help="Encode the complete selected segments instead of a short probe from the middle of each",
+    )
+    node_parser.add_argument(
+        "--fused-metrics",
+        action="store_true",
+        help="Measure VMAF/PSNR while creating the test encodings instead of in a separate pass (libx264 only)",
+    )
 
     # Workflow runner command
     workflow_parser = subparsers.add_parser("workflow", help="Run the complete workflow")
@@ -328,6 +363,27 @@ def main():
         action="store_true",  # Makes it a boolean flag
         help="Attempt to use GPU for encoding (if applicable to the node, e.g., low_res_encoder)",
     )
+    workflow_parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="Number of concurrent FFmpeg jobs for test encodings and quality metrics (default: based on usable CPUs)",
+    )
+    workflow_parser.add_argument(
+        "--psnr-prefilter",
+        action="store_true",
+        help="Measure PSNR first and skip VMAF for test encodings dominated by a lower bitrate",
+    )
+    workflow_parser.add_argument(
+        "--full-segments",
+        action="store_true",
+        help="Encode the complete selected segments instead of a short probe from the middle of each",
+    )
+    workflow_parser.add_argument(
+        "--fused-metrics",
+        action="store_true",
+        help="Measure VMAF/PSNR while creating the test encodings instead of in a separate pass (libx264 only)",
+    )
 
     # Legacy commands for backward compatibility
     legacy_parser = subparsers.add_parser("analyze", help="Analyze video with Gemini API directly")
@@ -0,0 +1,69 @@
+"""
+Helpers shared by the nodes that run FFmpeg.
+"""
+
+import math
+import os
+import re
+from bisect import bisect_right
+from typing import List
+
+# CPU quota of the cgroup this process runs in (cgroup v2)
+_CGROUP_CPU_MAX_PATH = "/sys/fs/cgroup/cpu.max"
+
+
+def snap_to_keyframes(start_times: List[float], keyframes: List[float]) -> List[float]:
+    """
+    Move chunk start times back to the nearest keyframe at or before them.
+
+    Stream copying can only start a chunk on a keyframe, so the snapped times are the real
+    offsets of the chunks in the video.
+
+    Args:
+        start_times: Intended chunk start times in seconds, ascending
+        keyframes: Sorted keyframe timestamps in seconds
+
+    Returns:
+        Snapped start times, without duplicates (chunks that would start on the same keyframe are merged)
+    """
+    snapped = []
+    for start_time in start_times:
+        index = bisect_right(keyframes, start_time) - 1
+        snapped_time = keyframes[index] if index >= 0 else start_time
+        if snapped and snapped_time <= snapped[-1]:
+            continue
+        snapped.append(snapped_time)
+    return snapped
+
+
+def escape_tee_path(path: str) -> str:
+    """Escape characters that have a special meaning in a tee muxer slave specification."""
+    return re.sub(r"([\\|\[\]])", r"\\\1", path)
+
+
+def available_cpus() -> int:
+    """
+    Determine how many CPUs this process may actually use.
+
+    os.cpu_count() reports every CPU of the host, which oversubscribes containers that are pinned to a
+    subset of the CPUs or limited by a cgroup CPU quota.
+
+    Returns:
+        Number of usable CPUs (at least 1)
+    """
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        # sched_getaffinity is not available on macOS and Windows
+        cpus = os.cpu_count() or 1
+
+    # Respect a cgroup v2 CPU quota ("max 100000" means unlimited)
+    try:
+        with open(_CGROUP_CPU_MAX_PATH) as f:
+            quota, period = f.read().split()[:2]
+        if quota != "max":
+            cpus = min(cpus, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError, ZeroDivisionError):
+        pass
+
+    return max(1, cpus)
@@ -3,6 +3,7 @@ LangGraph setup for the EncodEx workflow.
 """
 
 import functools
+from typing import Optional
 
 from langgraph.graph import StateGraph
 
@@ -18,19 +19,34 @@ from encodex.nodes.test_encoding_generator import generate_test_encodings
 from encodex.nodes.video_splitter import split_video
 
 
-def create_graph(use_gpu: bool = False):
+def create_graph(
+    use_gpu: bool = False,
+    jobs: Optional[int] = None,
+    psnr_prefilter: bool = False,
+    full_segments: bool = False,
+    fused_metrics: bool = False,
+):
     """
     Create the EncodEx workflow graph.
 
     Args:
         use_gpu: Whether to attempt using GPU for relevant nodes.
+        jobs: Number of concurrent FFmpeg jobs for test encodings and quality metrics (None derives it from the CPUs).
+        psnr_prefilter: Whether to skip VMAF for test encodings whose PSNR is dominated by a lower bitrate.
+        full_segments: Whether to encode the complete selected segments instead of a short probe of each.
+        fused_metrics: Whether to measure VMAF and PSNR while creating the test encodings.
     """
     # Define the graph with the EnCodexState as the state type
     workflow = StateGraph(EnCodexState)
 
     # Prepare node functions, potentially binding the use_gpu argument
     low_res_encoder_node = functools.partial(create_low_res_preview, use_gpu=use_gpu)
-    test_encoding_generator_node = functools.partial(generate_test_encodings, use_gpu=use_gpu)
+    test_encoding_generator_node = functools.partial(
+        generate_test_encodings, use_gpu=use_gpu, jobs=jobs, full_segments=full_segments, fused_metrics=fused_metrics
+    )
+    quality_metrics_calculator_node = functools.partial(
+        calculate_quality_metrics, jobs=jobs, psnr_prefilter=psnr_prefilter
+    )
 
     # Add all nodes to the graph
     workflow.add_node("input_processor", process_input)
@@ -38,7 +54,7 @@ def create_graph(use_gpu: bool = False):
     workflow.add_node("video_splitter", split_video)
     workflow.add_node("content_analyzer", analyze_content)
     workflow.add_node("test_encoding_generator", test_encoding_generator_node)
-    workflow.add_node("quality_metrics_calculator", calculate_quality_metrics)
+    workflow.add_node("quality_metrics_calculator", quality_metrics_calculator_node)
     workflow.add_node("data_aggregator", aggregate_data)
     workflow.add_node("recommendation_engine", generate_recommendations)
     workflow.add_node("output_generator", generate_output)
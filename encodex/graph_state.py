@@ -3,7 +3,7 @@ State management for the EncodEx LangGraph.
 """
 
 from enum import Enum
-from typing import Dict, List, Optional
+from typing import Any, Dict, List, Optional
 
 from pydantic import BaseModel, Field
 
@@ -64,6 +64,8 @@ class TestEncoding(BaseModel):
     resolution: str
     bitrate: int
     segment: str  # References a segment ID
+    vmaf: Optional[float] = None  # Set when the quality was measured while encoding
+    psnr: Optional[float] = None  # Set when the quality was measured while encoding
 
 
 class QualityMetric(BaseModel):
@@ -72,6 +74,8 @@ class QualityMetric(BaseModel):
     encoding_id: str  # Reference to a test encoding
     vmaf: float
     psnr: Optional[float] = None
+    resolution: Optional[str] = None  # Copied from the test encoding, e.g. "1280x720"
+    bitrate_kbps: Optional[int] = None  # Copied from the test encoding
 
 
 class ComplexityCategory(str, Enum):
@@ -98,6 +102,7 @@ class EnCodexState(BaseModel):
     video_metadata: Optional[VideoMetadata] = None
     low_res_path: Optional[str] = None
     chunk_paths: List[str] = Field(default_factory=list)
+    # Offset in seconds of every chunk in chunk_paths, always set by the video splitter
     chunk_start_times: Dict[str, float] = Field(default_factory=dict)
     chunk_uri_map: Optional[Dict[str, str]] = Field(default_factory=dict)
     content_analysis: Optional[ContentAnalysis] = None
@@ -107,4 +112,5 @@ class EnCodexState(BaseModel):
     complexity_category: Optional[ComplexityCategory] = None
     encoding_ladder: List[EncodingParameters] = Field(default_factory=list)
     estimated_savings: Optional[str] = None
+    output_json: Optional[Dict[str, Any]] = None
     error: Optional[str] = None
@@ -21,6 +21,9 @@ from encodex.graph_state import (
 # Regex to check if the input looks like a Gemini File API URI (e.g., "files/...")
 GEMINI_FILE_URI_PATTERN = r"^files\/[a-zA-Z0-9_-]+$"
 
+# Timestamps in the formats "HH:MM:SS.ms", "MM:SS.ms" or "SS.ms"
+_TIMESTAMP_RE = re.compile(r"^\s*(?:(?:(\d+):)?(\d+):)?(\d+(?:\.\d*)?|\.\d+)\s*$")
+
 # Analysis prompt from the spec
 ANALYSIS_PROMPT = """
 Analyze this video sample and provide a structured assessment of the following
@@ -394,20 +397,14 @@ def _parse_timestamp(timestamp_str: str) -> float:
     Parse a timestamp string into seconds.
     Handles formats like "HH:MM:SS.ms", "MM:SS.ms", or just "SS.ms".
     """
-    parts = timestamp_str.strip().split(":")
-    try:
-        if len(parts) == 3:  # HH:MM:SS.ms
-            return int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[2])
-        elif len(parts) == 2:  # MM:SS.ms
-            return int(parts[0]) * 60 + float(parts[1])
-        elif len(parts) == 1:  # SS.ms
-            return float(parts[0])
-        else:
-            raise ValueError(f"Invalid timestamp format: {timestamp_str}")
-    except ValueError as e:
-        print(f"Warning: Could not parse timestamp '{timestamp_str}': {e}. Returning 0.0")
+    match = _TIMESTAMP_RE.match(timestamp_str)
+    if not match:
+        print(f"Warning: Could not parse timestamp '{timestamp_str}': Invalid timestamp format. Returning 0.0")
         return 0.0
 
+    hours, minutes, seconds = match.groups()
+    return int(hours or 0) * 3600 + int(minutes or 0) * 60 + float(seconds)
+
 
 def _map_to_content_analysis(analysis_data: Dict[str, Any]) -> ContentAnalysis:
     """Map raw analysis data to ContentAnalysis model."""
@@ -5,6 +5,7 @@ This node aggregates content analysis and quality metrics data to determine the
 overall complexity category and prepare data for recommendation generation.
 """
 
+import bisect
 import logging
 from typing import Dict, List, Tuple
 
@@ -13,6 +14,19 @@ from encodex.graph_state import ComplexityCategory, EnCodexState, QualityMetric
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# Weights of the content characteristics in the complexity score, based on the specification.
+# Order: motion, temporal, spatial, scene changes, texture.
+_WEIGHTS = (0.35, 0.25, 0.20, 0.10, 0.10)
+
+# Upper bounds (exclusive) of the weighted score for each complexity category but the last
+_THRESHOLDS = (40, 60, 80)
+_CATEGORIES = (
+    ComplexityCategory.LOW,
+    ComplexityCategory.MEDIUM,
+    ComplexityCategory.HIGH,
+    ComplexityCategory.ULTRA_HIGH,
+)
+
 
 def _calculate_bitrate_quality_curve(
     quality_metrics: List[QualityMetric], use_vmaf: bool = True
@@ -67,23 +81,15 @@ def _determine_complexity_category(
     Returns:
         Tuple of (complexity_category, weighted_score)
     """
-    # Extract scores from content analysis
-    motion = content_analysis.motion_intensity.score
-    temporal = content_analysis.temporal_complexity.score
-    spatial = content_analysis.spatial_complexity.score
-    scene_changes = content_analysis.scene_change_frequency.score
-    texture = content_analysis.texture_detail_prevalence.score
-
-    # Calculate weighted average based on specification
-    weights = {"motion": 0.35, "temporal": 0.25, "spatial": 0.20, "scene_changes": 0.10, "texture": 0.10}
-
-    weighted_score = (
-        motion * weights["motion"]
-        + temporal * weights["temporal"]
-        + spatial * weights["spatial"]
-        + scene_changes * weights["scene_changes"]
-        + texture * weights["texture"]
+    # Calculate weighted average of the content characteristics
+    scores = (
+        content_analysis.motion_intensity.score,
+        content_analysis.temporal_complexity.score,
+        content_analysis.spatial_complexity.score,
+        content_analysis.scene_change_frequency.score,
+        content_analysis.texture_detail_prevalence.score,
     )
+    weighted_score = sum(weight * score for weight, score in zip(_WEIGHTS, scores))
 
     # Apply quality metrics analysis as an adjustment factor
     # Check how much quality is lost at lower bitrates
@@ -120,14 +126,7 @@ def _determine_complexity_category(
     weighted_score = min(weighted_score, 100)
 
     # Determine complexity category based on weighted score
-    if weighted_score < 40:
-        category = ComplexityCategory.LOW
-    elif weighted_score < 60:
-        category = ComplexityCategory.MEDIUM
-    elif weighted_score < 80:
-        category = ComplexityCategory.HIGH
-    else:
-        category = ComplexityCategory.ULTRA_HIGH
+    category = _CATEGORIES[bisect.bisect_right(_THRESHOLDS, weighted_score)]
 
     return category, weighted_score
 
@@ -2,17 +2,106 @@
 Low-resolution encoder node for creating a preview version of the video for analysis.
 """
 
-import json
+import functools
+import glob
 import os
 import platform
 import re  # Add re import for parsing progress
 import subprocess
 import sys  # Add sys import for stdout flushing
+from typing import Optional
 
+from encodex.ffmpeg_utils import escape_tee_path
 from encodex.graph_state import EnCodexState
 
+# FFmpeg -progress key carrying the output position (in microseconds, despite the name)
+_PROG_RE = re.compile(rb"out_time_ms=(\d+)")
+
+# Platform is fixed for the lifetime of the process, so look it up once
+_IS_DARWIN = platform.system() == "Darwin"
+
+# Upper bound for the preview bitrate, used to decide up front whether the preview needs chunking
+_PREVIEW_MAX_BITRATE_KBPS = 600
+
+# Encoder options for the VideoToolbox hardware encoder (macOS)
+# Note: '-crf' and '-preset' are not typically used with videotoolbox
+_VIDEOTOOLBOX_ARGS = (
+    "-c:v",
+    "h264_videotoolbox",
+    "-realtime",
+    "1",  # Real-time mode is fastest and plenty for a 240p proxy
+    "-b:v",
+    "500k",  # Target bitrate for low-res preview
+    "-allow_sw",
+    "1",  # Enable software fallback (provide value '1')
+    "-profile:v",
+    "baseline",
+)
+
+# Encoder options for the libx264 CPU encoder, following the preset.
+# The spec (section 11.2) uses -crf 23 -preset fast, but the preview is a throwaway
+# analysis proxy, so a much faster preset and a higher CRF are good enough for Gemini.
+_LIBX264_ARGS = (
+    "-crf",
+    "30",  # Constant Rate Factor (proxy quality is sufficient for analysis)
+    "-maxrate",
+    f"{_PREVIEW_MAX_BITRATE_KBPS}k",  # Cap the bitrate so the preview size is predictable
+    "-bufsize",
+    f"{_PREVIEW_MAX_BITRATE_KBPS * 2}k",
+    "-tune",
+    # zerolatency switches to sliced threads and disables B-frames, which keeps all cores busy
+    # on short clips; fastdecode makes the preview cheaper to split and process
+    "fastdecode,zerolatency",
+    "-g",
+    "48",  # Regular keyframes so the preview can be split into chunks precisely
+)
+
+# Maximum size of a chunk uploaded to Gemini
+_MAX_CHUNK_SIZE_MB = 50
+
+
+@functools.lru_cache(maxsize=None)
+def _has_videotoolbox() -> bool:
+    """
+    Check once whether the local FFmpeg build includes the h264_videotoolbox encoder.
+
+    Returns:
+        True if h264_videotoolbox is available, False otherwise
+    """
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True)
+    except OSError:
+        return False
+    return "h264_videotoolbox" in result.stdout
+
 
-def create_low_res_preview(state: EnCodexState, use_gpu: bool = False) -> EnCodexState:
+def _plan_preview_chunks(duration: Optional[float], max_size_mb: int = _MAX_CHUNK_SIZE_MB) -> Optional[float]:
+    """
+    Decide whether the preview may exceed the Gemini size limit and, if so, how long each chunk should be.
+
+    The estimate uses the preview's capped bitrate, so it is a worst case; the video splitter still
+    checks the actual preview size before using the chunks, and deletes them if they are not needed.
+
+    Args:
+        duration: Duration of the video in seconds
+        max_size_mb: Maximum size of each chunk in MB
+
+    Returns:
+        Chunk duration in seconds, or None if the preview is expected to fit in a single chunk
+    """
+    if not duration:
+        return None
+
+    estimated_size_mb = duration * _PREVIEW_MAX_BITRATE_KBPS * 1000 / 8 / (1024 * 1024)
+    if estimated_size_mb <= max_size_mb:
+        return None
+
+    # Add 10% buffer to account for keyframe alignment and overhead (same as the video splitter)
+    num_chunks = int((estimated_size_mb / max_size_mb) * 1.1) + 1
+    return duration / num_chunks
+
+
+def create_low_res_preview(state: EnCodexState, use_gpu: bool = False, preset: str = "ultrafast") -> EnCodexState:
     """
     Create a low-resolution preview of the input video for analysis:
     - Generate a 240p low-bitrate version of the video
@@ -23,6 +112,8 @@ def create_low_res_preview(state: EnCodexState, use_gpu: bool = False) -> EnCode
         state: Current graph state with input file and metadata
         use_gpu: If True and on macOS, attempt to use the VideoToolbox hardware encoder.
                  Defaults to False (uses libx264 CPU encoder).
+        preset: libx264 preset for the CPU encoder. The preview is only an analysis proxy,
+                so the fastest preset is used by default.
 
     Returns:
         Updated state with low_res_path
@@ -57,38 +148,51 @@ def create_low_res_preview(state: EnCodexState, use_gpu: bool = False) -> EnCode
             "scale=trunc(oh*a/2)*2:240",  # Scale to 240p ensuring even width
         ]
 
-        # Add progress reporting to stdout
-        progress_cmd = ["-progress", "pipe:1"]
+        # Add progress reporting to stdout, once per second. Keep the stats line and banner off
+        # stderr so it only carries errors and cannot fill up while we read stdout.
+        progress_cmd = ["-progress", "pipe:1", "-stats_period", "1", "-nostats", "-loglevel", "error"]
 
-        encoder_cmd = []
         # Use VideoToolbox on macOS if requested
-        if use_gpu and platform.system() == "Darwin":
+        if use_gpu and _IS_DARWIN and _has_videotoolbox():
             print("Attempting to use hardware encoder (h264_videotoolbox)...")
-            encoder_cmd = [
-                "-c:v",
-                "h264_videotoolbox",
-                "-b:v",
-                "300k",  # Target bitrate for low-res preview
-                "-allow_sw",
-                "1",  # Enable software fallback (provide value '1')
-                # Note: '-crf' and '-preset' are not typically used with videotoolbox
-            ]
+            encoder_cmd = list(_VIDEOTOOLBOX_ARGS)
         else:
-            # Default to libx264 CPU encoding
-            # Using settings from spec (section 11.2):
-            # ffmpeg -i [INPUT] -vf scale=-1:240 -c:v libx264 -crf 23 -preset fast [OUTPUT]
-            print("Using CPU encoder (libx264)...")
-            encoder_cmd = [
-                "-c:v",
-                "libx264",  # Use H.264 codec
-                "-crf",
-                "23",  # Constant Rate Factor (balance quality/size)
-                "-preset",
-                "fast",  # Encoding speed preset
+            if use_gpu:
+                print("Hardware encoder (h264_videotoolbox) not available, falling back to CPU.")
+            print(f"Using CPU encoder (libx264, preset {preset})...")
+            encoder_cmd = ["-c:v", "libx264", "-preset", preset, *_LIBX264_ARGS]
+
+        # If the preview may be too large for Gemini, write the chunks in the same FFmpeg run:
+        # the tee muxer feeds the encoded stream both to the preview file and to a segment muxer,
+        # so the video splitter doesn't have to read the preview again. Keyframes are forced on
+        # the chunk boundaries so every chunk starts exactly at a multiple of the chunk duration.
+        chunk_duration = _plan_preview_chunks(state.video_metadata.duration)
+        chunk_base, chunk_ext = os.path.splitext(low_res_path)
+        chunk_pattern = f"{glob.escape(chunk_base)}_[0-9][0-9][0-9]{chunk_ext}"
+        if chunk_duration:
+            # Remove chunks left over from a previous run so they are not picked up below
+            for stale_chunk in glob.glob(chunk_pattern):
+                os.remove(stale_chunk)
+
+            chunk_template = escape_tee_path(chunk_base.replace("%", "%%")) + f"_%03d{chunk_ext}"
+            output_cmd = [
+                "-force_key_frames",
+                f"expr:gte(t,n_forced*{chunk_duration:.6f})",
+                "-flags",
+                "+global_header",  # Required by the mp4 outputs behind the tee muxer
+                "-map",
+                "0:v:0",  # Only the main video stream, not attached pictures such as cover art
+                "-f",
+                "tee",
+                f"{escape_tee_path(low_res_path)}"
+                f"|[f=segment:segment_time={chunk_duration:.6f}:segment_start_number=1:reset_timestamps=1]"
+                f"{chunk_template}",
             ]
+        else:
+            output_cmd = [low_res_path]
 
-        # Combine command parts: base + progress + encoder + audio disable + output path
-        final_cmd = base_cmd + progress_cmd + encoder_cmd + ["-an", low_res_path]
+        # Combine command parts: base + progress + encoder + audio disable + output(s)
+        final_cmd = base_cmd + progress_cmd + encoder_cmd + ["-an"] + output_cmd
 
         # Run FFmpeg using Popen to capture progress
         print(f"Running FFmpeg command: {' '.join(final_cmd)}")  # Keep this for debugging
@@ -96,9 +200,7 @@ def create_low_res_preview(state: EnCodexState, use_gpu: bool = False) -> EnCode
             final_cmd,
             stdout=subprocess.PIPE,  # Capture progress from stdout
             stderr=subprocess.PIPE,  # Capture errors from stderr
-            text=True,  # Decode output as text
-            encoding="utf-8",  # Specify encoding
-            bufsize=1,  # Line buffered
+            bufsize=65536,
         )
 
         # Get total duration for percentage calculation
@@ -107,22 +209,30 @@ def create_low_res_preview(state: EnCodexState, use_gpu: bool = False) -> EnCode
             total_duration_ms = state.video_metadata.duration * 1000000  # Convert seconds to microseconds
 
         print("Encoding low-res preview...")
-        # Read progress from stdout
-        while True:
-            if process.stdout is None:
-                break
-            line = process.stdout.readline()
-            if not line:
+        # Read progress from stdout in large raw chunks. Only the last complete 'out_time_ms'
+        # entry of each chunk matters, so it is located with rfind and only its number is parsed.
+        last_progress = None
+        pending = b""
+        while process.stdout is not None:
+            data = process.stdout.read1(65536)
+            if not data:
                 break
 
-            # Simple parsing for 'out_time_ms'
-            match = re.search(r"out_time_ms=(\d+)", line)
-            if match and total_duration_ms:
+            # Keep an incomplete trailing line for the next read
+            complete, _, pending = (pending + data).rpartition(b"\n")
+            pos = complete.rfind(b"out_time_ms=")
+            if pos == -1 or not total_duration_ms:
+                continue
+
+            match = _PROG_RE.match(complete, pos)
+            if match:
                 current_ms = int(match.group(1))
-                progress = (current_ms / total_duration_ms) * 100
-                # Print progress on the same line
-                print(f"\rProgress: {progress:.1f}%", end="")
-                sys.stdout.flush()  # Ensure it prints immediately
+                progress = f"{(current_ms / total_duration_ms) * 100:.1f}"
+                # Print progress on the same line, only when it changed
+                if progress != last_progress:
+                    print(f"\rProgress: {progress}%", end="")
+                    sys.stdout.flush()  # Ensure it prints immediately
+                    last_progress = progress
 
         # Wait for the process to finish and capture remaining output/errors
         stdout, stderr = process.communicate()
@@ -131,7 +241,7 @@ def create_low_res_preview(state: EnCodexState, use_gpu: bool = False) -> EnCode
         print("\rEncoding complete.      ")  # Overwrite progress line
 
         if process.returncode != 0:
-            state.error = f"FFmpeg error (code {process.returncode}): {stderr}"
+            state.error = f"FFmpeg error (code {process.returncode}): {stderr.decode(errors='replace')}"
             return state
 
         # Check if output file exists
@@ -142,70 +252,14 @@ def create_low_res_preview(state: EnCodexState, use_gpu: bool = False) -> EnCode
         # Update state
         state.low_res_path = low_res_path
 
+        # Record the chunks written alongside the preview; the video splitter decides whether to use them
+        if chunk_duration:
+            chunk_paths = sorted(glob.glob(chunk_pattern))
+            state.chunk_paths = chunk_paths
+            state.chunk_start_times = {path: i * chunk_duration for i, path in enumerate(chunk_paths)}
+
         return state
 
     except Exception as e:
         state.error = f"Error creating low-res preview: {str(e)}"
         return state
-
-
-def split_video_for_gemini(low_res_path: str, max_size_mb: int = 50) -> list:
-    """
-    Split the low-res video into chunks that are small enough for Gemini.
-
-    Args:
-        low_res_path: Path to the low-res video
-        max_size_mb: Maximum size of each chunk in MB
-
-    Returns:
-        List of paths to the chunk files
-    """
-    # Get file size in bytes
-    file_size = os.path.getsize(low_res_path)
-    file_size_mb = file_size / (1024 * 1024)
-
-    # If file is already small enough, return it as is
-    if file_size_mb <= max_size_mb:
-        return [low_res_path]
-
-    # Calculate number of chunks needed
-    num_chunks = int(file_size_mb / max_size_mb) + 1
-
-    # Get video duration
-    cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", low_res_path]
-    result = subprocess.run(cmd, capture_output=True, text=True)
-    metadata = json.loads(result.stdout)
-    duration = float(metadata.get("format", {}).get("duration", 0))
-
-    # Calculate chunk duration
-    chunk_duration = duration / num_chunks
-
-    # Create chunks
-    base_path, ext = os.path.splitext(low_res_path)
-    chunks = []
-
-    for i in range(num_chunks):
-        start_time = i * chunk_duration
-        output_path = f"{base_path}_{i + 1:03d}{ext}"
-
-        cmd = [
-            "ffmpeg",
-            "-y",
-            "-i",
-            low_res_path,
-            "-ss",
-            str(start_time),
-            "-t",
-            str(chunk_duration),
-            "-c",
-            "copy",
-            output_path,
-        ]
-
-        subprocess.run(cmd, capture_output=True)
-
-        # Verify file was created
-        if os.path.exists(output_path):
-            chunks.append(output_path)
-
-    return chunks
@@ -28,27 +28,29 @@ def _create_output_json(state: EnCodexState) -> Dict[str, Any]:
     # Extract input file name
     input_filename = os.path.basename(state.input_file)
 
+    # Format the duration as HH:MM:SS
+    hours, remainder = divmod(int(state.video_metadata.duration), 3600)
+    minutes, seconds = divmod(remainder, 60)
+
     # Prepare metadata section
     metadata = {
-        "duration": (
-            f"{int(state.video_metadata.duration // 3600):02d}:{int((state.video_metadata.duration % 3600) // 60):02d}"
-            ":{int(state.video_metadata.duration % 60):02d}"
-        ),
+        "duration": f"{hours:02d}:{minutes:02d}:{seconds:02d}",
         "original_resolution": f"{state.video_metadata.width}x{state.video_metadata.height}",
         "fps": state.video_metadata.fps,
     }
 
     # Prepare content analysis section
+    analysis = state.content_analysis
     content_analysis = {
         "complexity_category": state.complexity_category.value,
-        "motion_intensity": int(state.content_analysis.motion_intensity.score),
-        "spatial_complexity": int(state.content_analysis.spatial_complexity.score),
-        "temporal_complexity": int(state.content_analysis.temporal_complexity.score),
-        "scene_change_frequency": int(state.content_analysis.scene_change_frequency.score),
-        "texture_detail": int(state.content_analysis.texture_detail_prevalence.score),
-        "contrast_levels": int(state.content_analysis.contrast_levels.score),
-        "animation_type": state.content_analysis.animation_type.type,
-        "grain_noise_levels": int(state.content_analysis.grain_noise_levels.score),
+        "motion_intensity": int(analysis.motion_intensity.score),
+        "spatial_complexity": int(analysis.spatial_complexity.score),
+        "temporal_complexity": int(analysis.temporal_complexity.score),
+        "scene_change_frequency": int(analysis.scene_change_frequency.score),
+        "texture_detail": int(analysis.texture_detail_prevalence.score),
+        "contrast_levels": int(analysis.contrast_levels.score),
+        "animation_type": analysis.animation_type.type,
+        "grain_noise_levels": int(analysis.grain_noise_levels.score),
     }
 
     # Prepare encoding ladder section
@@ -76,7 +78,7 @@ def generate_output(state: EnCodexState) -> EnCodexState:
         state: Current workflow state with encoding ladder
 
     Returns:
-        Updated workflow state (no changes needed)
+        Updated workflow state with the final output JSON
     """
     logger.info("Starting output generator node.")
 
@@ -94,13 +96,14 @@ def generate_output(state: EnCodexState) -> EnCodexState:
         # Create the formatted output
         output_json = _create_output_json(state)
 
-        # Log the output
-        logger.info("Generated final output JSON:")
-        logger.info(json.dumps(output_json, indent=2))
+        # Log the output; the pretty-printed dump is only worth building when debugging
+        logger.info("Generated final output JSON.")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps(output_json, indent=2))
 
-        # We don't need to modify the state since it already contains all
-        # the necessary information. The output JSON would typically be
-        # written to a file by the CLI or other external handler.
+        # Attach the output to the state so it is written out together with the rest of the
+        # state by the CLI or other external handler, without being serialized again here.
+        state.output_json = output_json
 
         logger.info("Output generator node finished.")
         return state
@@ -5,168 +5,386 @@ This node calculates objective quality metrics (VMAF, PSNR) for test encodings
 by comparing them to the original source video.
 """
 
+import asyncio
+import functools
+import hashlib
 import json
 import logging
+import math
 import os
+import re
+import sqlite3
 import subprocess
 import tempfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, List, Optional, Tuple
 
-from encodex.graph_state import EnCodexState, QualityMetric
+from encodex.ffmpeg_utils import available_cpus
+from encodex.graph_state import EnCodexState, QualityMetric, TestEncoding
+from encodex.vmaf import (
+    DEFAULT_VMAF_SUBSAMPLE,
+    PSNR_MAX_DB,
+    PSNR_PEAK,
+    VMAF_CUDA_FILTER,
+    VMAF_FILTER,
+    VMAF_MODEL,
+    build_scale_filter,
+    parse_resolution,
+    parse_vmaf_log,
+    positive_int_from_env,
+    read_vmaf_logs,
+    vmaf_subsample,
+)
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
+# Default number of FFmpeg threads per concurrent metric job when --jobs is not given
+_DEFAULT_THREADS_PER_JOB = 4
 
-def _run_ffmpeg_command(cmd: List[str]) -> Tuple[bool, str]:
+# Environment variable to override the number of FFmpeg/libvmaf threads per concurrent metric job
+_VMAF_THREADS_ENV = "ENCODEX_VMAF_THREADS"
+
+# Set ENCODEX_VMAF_GPU=1 to compute VMAF with the CUDA build of libvmaf (libvmaf_cuda) when FFmpeg has it
+_VMAF_GPU_ENV = "ENCODEX_VMAF_GPU"
+
+# Persistent cache of VMAF/PSNR results, so unchanged encodings are not measured again on re-runs.
+# ENCODEX_VMAF_CACHE overrides the location of the cache database; set it to 0 to disable the cache.
+_VMAF_CACHE_ENV = "ENCODEX_VMAF_CACHE"
+_DEFAULT_VMAF_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "encodex", "vmaf.db")
+
+# Number of bytes at the start of the source video hashed to identify it
+_SOURCE_FINGERPRINT_BYTES = 1024 * 1024
+
+# Maximum number of concurrent stat calls when checking the test encodings (hides network filesystem latency)
+_MAX_STAT_WORKERS = 16
+
+# Number of trailing FFmpeg stderr lines kept for error reporting
+_STDERR_TAIL_LINES = 200
+
+# FFmpeg invocation without the banner, per-frame stats and info chatter, so stderr only carries errors
+_FFMPEG = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-nostats"]
+
+# On POSIX systems libvmaf writes its JSON log straight into our stdout pipe instead of a temporary file
+_VMAF_LOG_TO_STDOUT = os.name == "posix"
+
+# Filter template of FFmpeg's psnr filter, used to rank encodings before measuring VMAF
+_PSNR_FILTER = "[{distorted}][{reference}]psnr=stats_file={stats_path}"
+
+# Per-frame average MSE in the stats file of FFmpeg's psnr filter
+_MSE_AVG_RE = re.compile(r"mse_avg:([0-9.]+)")
+
+# Segment IDs have the form "start_time-end_time", e.g. "12.5-17.5"
+_SEG_RE = re.compile(r"^([0-9.]+)-([0-9.]+)$")
+
+
+async def _run_ffmpeg_command(cmd: List[str], capture_stdout: bool = False) -> Tuple[bool, str, str]:
     """
     Run an FFmpeg command and return success status and output.
 
+    Only the last lines of stderr are kept, so long FFmpeg runs do not accumulate their whole
+    log in memory. Stdout is discarded unless it is explicitly requested.
+
     Args:
         cmd: FFmpeg command as a list of strings
+        capture_stdout: Whether to capture and return stdout
+
+    Returns:
+        Tuple of (success_status, stdout, stderr_tail_or_error)
+    """
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE if capture_stdout else asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+
+    stderr_tail = deque(maxlen=_STDERR_TAIL_LINES)
+
+    async def drain_stderr() -> None:
+        async for line in process.stderr:
+            stderr_tail.append(line.decode(errors="replace"))
+
+    stdout = ""
+    if capture_stdout:
+        # Read both pipes concurrently so neither can fill up and block FFmpeg
+        stdout_bytes, _ = await asyncio.gather(process.stdout.read(), drain_stderr())
+        stdout = stdout_bytes.decode(errors="replace")
+    else:
+        await drain_stderr()
+    await process.wait()
+
+    stderr = "".join(stderr_tail)
+    if process.returncode != 0:
+        return False, stdout, f"FFmpeg error (Exit Code {process.returncode}): {stderr}"
+    return True, stdout, stderr
+
+
+@functools.lru_cache(maxsize=None)
+def _has_libvmaf_cuda() -> bool:
+    """
+    Check once whether the local FFmpeg build includes the libvmaf_cuda filter.
 
     Returns:
-        Tuple of (success_status, output_or_error)
+        True if libvmaf_cuda is available, False otherwise
     """
     try:
-        result = subprocess.run(cmd, check=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        return True, result.stdout + result.stderr  # Combine stdout and stderr to catch all output
-    except subprocess.CalledProcessError as e:
-        return False, f"FFmpeg error: {e.stderr}"
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-filters"], capture_output=True, text=True)
+        return "libvmaf_cuda" in result.stdout
+    except OSError:
+        return False
 
 
-def _calculate_vmaf(
-    test_encoding_path: str, original_video_path: str, start_time: float, duration: float
+def _use_vmaf_gpu() -> bool:
+    """
+    Determine whether VMAF should be computed on the GPU.
+
+    Returns:
+        True if ENCODEX_VMAF_GPU=1 is set and FFmpeg has libvmaf_cuda, False otherwise
+    """
+    if os.environ.get(_VMAF_GPU_ENV) != "1":
+        return False
+    if not _has_libvmaf_cuda():
+        logger.warning(f"{_VMAF_GPU_ENV}=1 is set, but FFmpeg has no libvmaf_cuda filter; using CPU libvmaf")
+        return False
+    return True
+
+
+async def _decode_reference_segment(  # noqa: PLR0913 Too many arguments
+    original_video_path: str,
+    start_time: float,
+    duration: float,
+    output_path: str,
+    threads: int = 1,
+    reference_resolution: Optional[Tuple[int, int]] = None,
+) -> bool:
+    """
+    Decode a segment of the original video once into a raw Y4M file at the metric resolution.
+
+    The Y4M file is used as the reference for every test encoding of that segment, so the
+    (often high resolution) source is decoded and scaled once per segment instead of once
+    per metric and encoding.
+
+    Args:
+        original_video_path: Path to the original video file
+        start_time: Start time of the segment in seconds
+        duration: Duration of the segment in seconds
+        output_path: Path of the Y4M file to create
+        threads: Number of FFmpeg decoding threads
+        reference_resolution: Resolution of the original video, if known
+
+    Returns:
+        True if the reference segment was decoded successfully, False otherwise
+    """
+    cmd = [
+        *_FFMPEG,
+        "-y",
+        "-threads",
+        str(threads),
+        "-ss",
+        str(start_time),
+        "-t",
+        str(duration),
+        "-i",
+        original_video_path,
+        # Let the scaler work on slices in parallel instead of on a single thread
+        "-filter_complex_threads",
+        str(threads),
+        "-filter_complex",
+        build_scale_filter("0:v", "reference", reference_resolution),
+        "-map",
+        "[reference]",
+        "-pix_fmt",
+        "yuv420p",
+        "-f",
+        "yuv4mpegpipe",
+        output_path,
+    ]
+
+    success, _, output = await _run_ffmpeg_command(cmd)
+    if not success:
+        logger.warning(f"Decoding reference segment failed: {output}")
+    return success
+
+
+async def _calculate_vmaf(
+    test_encoding_path: str,
+    reference_path: str,
+    duration: float,
+    threads: int = 1,
+    distorted_resolution: Optional[Tuple[int, int]] = None,
+    subsample: int = DEFAULT_VMAF_SUBSAMPLE,
 ) -> Optional[Dict]:
     """
     Calculate VMAF score for a test encoding compared to the original.
 
     Args:
         test_encoding_path: Path to the test encoding file
-        original_video_path: Path to the original video file
-        start_time: Start time of the segment in seconds
+        reference_path: Path to the decoded reference segment (Y4M at the metric resolution)
         duration: Duration of the segment in seconds
+        threads: Number of FFmpeg decoding threads per input and libvmaf worker threads
+        distorted_resolution: Resolution of the test encoding, if known
+        subsample: Compute the metrics on every n-th frame only
 
     Returns:
-        Dictionary with VMAF scores if successful, None otherwise
+        Dictionary with the VMAF score and PSNR (None if unavailable) if successful, None otherwise
     """
-    # Create temporary file for JSON output
-    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp_file:
-        output_json = tmp_file.name
+    # Let libvmaf write its JSON log to stdout where possible, otherwise fall back to a temporary file
+    output_json = None
+    if _VMAF_LOG_TO_STDOUT:
+        log_path = "/dev/stdout"
+    else:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp_file:
+            output_json = tmp_file.name
+        log_path = output_json
 
     try:
-        # Build FFmpeg command for VMAF calculation with explicit scaling
-        # The error shows we need to ensure both videos are at the same resolution
+        # Build FFmpeg command for VMAF calculation with explicit scaling.
+        # Both videos must be at the same resolution; the reference already is.
+        # libvmaf uses the same thread budget as the decoder for its feature extraction.
+        vmaf_filter = VMAF_FILTER.format(
+            distorted="distorted", reference="1:v", threads=threads, subsample=subsample, log_path=log_path
+        )
         cmd = [
-            "ffmpeg",
-            "-i",
-            test_encoding_path,
-            "-ss",
-            str(start_time),
+            *_FFMPEG,
+            # The test encoding already starts at the segment start, so it only needs a duration.
+            # The reference is the pre-decoded segment, so it needs neither seeking nor decoding.
+            "-threads",
+            str(threads),
             "-t",
             str(duration),
             "-i",
-            original_video_path,
+            test_encoding_path,
+            "-i",
+            reference_path,
+            # The upscale of low rungs is the costliest filter, so let it run on slices in parallel
+            "-filter_complex_threads",
+            str(threads),
             "-filter_complex",
-            "[0:v]scale=1920:1080:flags=bicubic[distorted];"
-            "[1:v]scale=1920:1080:flags=bicubic[reference];"
-            "[distorted][reference]libvmaf=log_fmt=json:log_path=" + output_json,
+            build_scale_filter("0:v", "distorted", distorted_resolution) + ";" + vmaf_filter,
             "-f",
             "null",
             "-",
         ]
 
         # Run FFmpeg command
-        success, output = _run_ffmpeg_command(cmd)
+        success, stdout, output = await _run_ffmpeg_command(cmd, capture_stdout=_VMAF_LOG_TO_STDOUT)
         if not success:
             logger.warning(f"VMAF calculation failed: {output}")
             return None
 
         # Parse VMAF JSON output
-        with open(output_json, "r") as f:
-            vmaf_data = json.load(f)
-
-        # Extract VMAF score
-        vmaf_score = None
-        if "pooled_metrics" in vmaf_data and "vmaf" in vmaf_data["pooled_metrics"]:
-            vmaf_score = vmaf_data["pooled_metrics"]["vmaf"].get("mean", None)
-
-        # Return VMAF score
-        if vmaf_score is not None:
-            return {"vmaf": vmaf_score}
+        if output_json:
+            with open(output_json, "r") as f:
+                vmaf_data = json.load(f)
         else:
-            logger.warning("Could not find VMAF score in output")
-            return None
+            vmaf_data = json.loads(stdout)
+
+        return parse_vmaf_log(vmaf_data)
 
     except Exception as e:
         logger.error(f"Error calculating VMAF: {str(e)}")
         return None
     finally:
         # Clean up temporary file
-        if os.path.exists(output_json):
+        if output_json and os.path.exists(output_json):
             os.remove(output_json)
 
 
-def _calculate_psnr(
-    test_encoding_path: str, original_video_path: str, start_time: float, duration: float
-) -> Optional[float]:
+def _build_batch_command(  # noqa: PLR0913 Too many arguments
+    encodings: List[Tuple[str, Optional[Tuple[int, int]]]],
+    reference_path: str,
+    duration: float,
+    threads: int,
+    metric_filters: List[str],
+    input_options: Tuple[str, ...] = (),
+) -> List[str]:
     """
-    Calculate PSNR score for a test encoding compared to the original.
+    Build an FFmpeg command that compares all test encodings of one segment against its reference.
+
+    Input 0 is the reference, which is split into one stream per test encoding (labelled
+    "reference{i}"); inputs 1..N are the test encodings, scaled to the metric resolution
+    (labelled "distorted{i}").
 
     Args:
-        test_encoding_path: Path to the test encoding file
-        original_video_path: Path to the original video file
-        start_time: Start time of the segment in seconds
+        encodings: Tuples of (test_encoding_path, distorted_resolution) of the same segment
+        reference_path: Path to the decoded reference segment (Y4M at the metric resolution)
         duration: Duration of the segment in seconds
+        threads: Number of FFmpeg threads for the whole run
+        metric_filters: Metric filter per encoding, consuming the "distorted{i}" and "reference{i}" labels
+        input_options: Extra options for each test encoding input
 
     Returns:
-        PSNR value if successful, None otherwise
+        FFmpeg command as a list of strings
     """
-    try:
-        # Build FFmpeg command for PSNR calculation with explicit scaling
-        cmd = [
-            "ffmpeg",
-            "-i",
-            test_encoding_path,
-            "-ss",
-            str(start_time),
-            "-t",
-            str(duration),
-            "-i",
-            original_video_path,
-            "-filter_complex",
-            "[0:v]scale=1920:1080:flags=bicubic[distorted];"
-            "[1:v]scale=1920:1080:flags=bicubic[reference];"
-            "[distorted][reference]psnr",
-            "-f",
-            "null",
-            "-",
+    cmd = [*_FFMPEG, "-i", reference_path]
+    filters = [f"[0:v]split={len(encodings)}" + "".join(f"[reference{i}]" for i in range(len(encodings)))]
+    for i, (test_encoding_path, distorted_resolution) in enumerate(encodings):
+        cmd += [*input_options, "-threads", str(threads), "-t", str(duration), "-i", test_encoding_path]
+        filters.append(build_scale_filter(f"{i + 1}:v", f"distorted{i}", distorted_resolution))
+        filters.append(metric_filters[i])
+
+    # The upscale of low rungs is the costliest filter, so let it run on slices in parallel
+    cmd += ["-filter_complex_threads", str(threads), "-filter_complex", ";".join(filters), "-f", "null", "-"]
+    return cmd
+
+
+async def _calculate_vmaf_batch(
+    encodings: List[Tuple[str, Optional[Tuple[int, int]]]],
+    reference_path: str,
+    duration: float,
+    threads: int = 1,
+    subsample: int = DEFAULT_VMAF_SUBSAMPLE,
+    gpu: bool = False,
+) -> Optional[List[Optional[Dict]]]:
+    """
+    Calculate VMAF scores for all test encodings of one segment in a single FFmpeg run.
+
+    The reference is read once and split to one libvmaf filter per test encoding, so process
+    startup, reference reading and VMAF model loading happen once per segment instead of once
+    per encoding.
+
+    Args:
+        encodings: Tuples of (test_encoding_path, distorted_resolution) of the same segment
+        reference_path: Path to the decoded reference segment (Y4M at the metric resolution)
+        duration: Duration of the segment in seconds
+        threads: Number of FFmpeg threads for the whole run, shared by the libvmaf filters
+        subsample: Compute the metrics on every n-th frame only
+        gpu: Decode the test encodings with CUDA and compute VMAF with libvmaf_cuda
+
+    Returns:
+        List with the result of _calculate_vmaf per encoding, or None if the FFmpeg run failed
+    """
+    vmaf_threads = max(1, threads // len(encodings))
+
+    with tempfile.TemporaryDirectory(prefix="encodex_vmaf_") as log_dir:
+        log_paths = [os.path.join(log_dir, f"vmaf_{i:03d}.json") for i in range(len(encodings))]
+
+        template = VMAF_CUDA_FILTER if gpu else VMAF_FILTER
+        metric_filters = [
+            template.format(
+                distorted=f"distorted{i}",
+                reference=f"reference{i}",
+                threads=vmaf_threads,
+                subsample=subsample,
+                log_path=log_path,
+            )
+            for i, log_path in enumerate(log_paths)
         ]
+        cmd = _build_batch_command(
+            encodings, reference_path, duration, threads, metric_filters, ("-hwaccel", "cuda") if gpu else ()
+        )
 
-        # Run FFmpeg command
-        success, output = _run_ffmpeg_command(cmd)
+        if gpu:
+            # Initialize the CUDA device used by hwupload_cuda
+            cmd[1:1] = ["-init_hw_device", "cuda=cuda", "-filter_hw_device", "cuda"]
+
+        success, _, output = await _run_ffmpeg_command(cmd)
         if not success:
-            logger.warning(f"PSNR calculation failed: {output}")
+            logger.warning(f"Batched VMAF calculation failed: {output}")
             return None
 
-        # Parse PSNR from FFmpeg output
-        # Look for the average PSNR line in FFmpeg output
-        psnr_avg = None
-        for line in output.split("\n"):
-            if "PSNR" in line and "average" in line:
-                try:
-                    # Format is typically: [Parsed_psnr_0 @ 0x...] PSNR average:27.31 min:24.22 max:31.58
-                    parts = line.split("average:")[1].strip().split(" ")
-                    psnr_avg = float(parts[0])
-                    break
-                except (IndexError, ValueError) as e:
-                    logger.warning(f"Failed to parse PSNR from line: {line}, error: {e}")
-
-        return psnr_avg
-
-    except Exception as e:
-        logger.error(f"Error calculating PSNR: {str(e)}")
-        return None
+        return read_vmaf_logs(log_paths)
 
 
 def _extract_segment_time_range(segment_id: str) -> Tuple[float, float]:
@@ -179,23 +397,520 @@ def _extract_segment_time_range(segment_id: str) -> Tuple[float, float]:
     Returns:
         Tuple of (start_time, duration)
     """
+    match = _SEG_RE.match(segment_id)
+    if not match:
+        logger.error(f"Error parsing segment ID '{segment_id}': expected 'start_time-end_time'")
+        return 0.0, 0.0
+
     try:
-        parts = segment_id.split("-")
-        start_time = float(parts[0])
-        end_time = float(parts[1])
-        duration = end_time - start_time
-        return start_time, duration
-    except (IndexError, ValueError) as e:
+        start_time = float(match.group(1))
+        end_time = float(match.group(2))
+        return start_time, end_time - start_time
+    except ValueError as e:
         logger.error(f"Error parsing segment ID '{segment_id}': {str(e)}")
         return 0.0, 0.0
 
 
-def calculate_quality_metrics(state: EnCodexState) -> EnCodexState:
+def _psnr_from_stats(stats_path: str) -> Optional[float]:
+    """
+    Compute the average PSNR from a stats file written by FFmpeg's psnr filter.
+
+    Like the filter's own summary, the average is the PSNR of the mean MSE over all frames.
+
+    Args:
+        stats_path: Path to the psnr stats file
+
+    Returns:
+        Average PSNR in dB, or None if the file has no frames
+    """
+    total_mse = 0.0
+    frames = 0
+    with open(stats_path, "r") as f:
+        for line in f:
+            match = _MSE_AVG_RE.search(line)
+            if match:
+                total_mse += float(match.group(1))
+                frames += 1
+
+    if not frames:
+        return None
+    if total_mse == 0:
+        return PSNR_MAX_DB
+    return min(PSNR_MAX_DB, 10 * math.log10(PSNR_PEAK / (total_mse / frames)))
+
+
+async def _calculate_psnr_batch(
+    encodings: List[Tuple[str, Optional[Tuple[int, int]]]],
+    reference_path: str,
+    duration: float,
+    threads: int = 1,
+) -> Optional[List[Optional[float]]]:
+    """
+    Calculate PSNR for all test encodings of one segment in a single FFmpeg run.
+
+    PSNR needs no model and is much cheaper than VMAF, which makes it a good first pass
+    to find the encodings that are clearly not worth a VMAF measurement.
+
+    Args:
+        encodings: Tuples of (test_encoding_path, distorted_resolution) of the same segment
+        reference_path: Path to the decoded reference segment (Y4M at the metric resolution)
+        duration: Duration of the segment in seconds
+        threads: Number of FFmpeg threads for the whole run
+
+    Returns:
+        List with the average PSNR per encoding, or None if the FFmpeg run failed
+    """
+    with tempfile.TemporaryDirectory(prefix="encodex_psnr_") as stats_dir:
+        stats_paths = [os.path.join(stats_dir, f"psnr_{i:03d}.log") for i in range(len(encodings))]
+
+        metric_filters = [
+            _PSNR_FILTER.format(distorted=f"distorted{i}", reference=f"reference{i}", stats_path=stats_path)
+            for i, stats_path in enumerate(stats_paths)
+        ]
+        cmd = _build_batch_command(encodings, reference_path, duration, threads, metric_filters)
+
+        success, _, output = await _run_ffmpeg_command(cmd)
+        if not success:
+            logger.warning(f"Batched PSNR calculation failed: {output}")
+            return None
+
+        results = []
+        for stats_path in stats_paths:
+            try:
+                results.append(_psnr_from_stats(stats_path))
+            except (OSError, ValueError) as e:
+                logger.error(f"Error reading PSNR stats {stats_path}: {str(e)}")
+                results.append(None)
+        return results
+
+
+def _find_undominated(encodings: List[TestEncoding], psnr_values: List[Optional[float]]) -> List[bool]:
+    """
+    Find the encodings that are not dominated by a cheaper encoding of the same segment.
+
+    Uses the same running-maximum rule as the convex hull in the recommendation engine: an
+    encoding is dominated if an encoding with a lower bitrate already reached a higher PSNR.
+
+    Args:
+        encodings: Test encodings of one segment
+        psnr_values: PSNR per encoding, None if unknown
+
+    Returns:
+        Per encoding whether it should be measured with VMAF
+    """
+    keep = [True] * len(encodings)
+    best_psnr = -math.inf
+    for i in sorted(range(len(encodings)), key=lambda i: encodings[i].bitrate):
+        psnr_value = psnr_values[i]
+        if psnr_value is None:
+            continue
+        if psnr_value < best_psnr:
+            keep[i] = False
+        best_psnr = max(best_psnr, psnr_value)
+    return keep
+
+
+def _build_quality_metric(encoding: TestEncoding, vmaf_result: Optional[Dict]) -> Optional[QualityMetric]:
+    """
+    Turn the VMAF result of a test encoding into a QualityMetric.
+
+    Args:
+        encoding: Measured test encoding
+        vmaf_result: Result of the VMAF calculation, None if it failed
+
+    Returns:
+        QualityMetric for the encoding, or None if VMAF could not be calculated
+    """
+    name = os.path.basename(encoding.path)
+
+    # Skip if VMAF calculation failed
+    if not vmaf_result:
+        logger.error(f"Failed to calculate VMAF for {name}")
+        return None
+
+    # Use -1.0 as fallback if PSNR calculation failed
+    psnr_value = vmaf_result["psnr"]
+    if psnr_value is None:
+        logger.warning(f"Using default PSNR value for {name}")
+        psnr_value = -1.0
+
+    # Log results
+    logger.info(f"Calculated metrics for {name}: VMAF={vmaf_result['vmaf']:.2f}, PSNR={psnr_value:.2f}")
+
+    # The values are already plain floats, so skip pydantic validation when building the model
+    return QualityMetric.model_construct(
+        encoding_id=name,
+        vmaf=float(vmaf_result["vmaf"]),
+        psnr=float(psnr_value),
+        resolution=encoding.resolution,
+        bitrate_kbps=encoding.bitrate,
+    )
+
+
+async def _process_segment(
+    encodings: List[TestEncoding],
+    reference_path: str,
+    duration: float,
+    threads: int,
+    subsample: int = DEFAULT_VMAF_SUBSAMPLE,
+    gpu: bool = False,
+    psnr_prefilter: bool = False,
+) -> List[Optional[QualityMetric]]:
+    """
+    Calculate the quality metrics for all test encodings of one segment.
+
+    With the PSNR prefilter, all encodings first get a cheap PSNR pass and only those that are not
+    dominated by a lower bitrate are measured with VMAF.
+
+    Args:
+        encodings: Test encodings of the segment
+        reference_path: Path to the decoded reference segment
+        duration: Duration of the segment in seconds
+        threads: Number of FFmpeg threads to use
+        subsample: Compute the metrics on every n-th frame only
+        gpu: Try computing VMAF with libvmaf_cuda first
+        psnr_prefilter: Measure PSNR first and skip VMAF for encodings dominated by a cheaper one
+
+    Returns:
+        QualityMetric per encoding (in the given order), None for encodings that could not be measured
+        or were skipped by the PSNR prefilter
+    """
+    metrics: List[Optional[QualityMetric]] = [None] * len(encodings)
+    selected = list(range(len(encodings)))
+
+    # Drop the encodings that are clearly dominated before spending a VMAF run on them
+    if psnr_prefilter and len(encodings) > 1:
+        all_inputs = [(encoding.path, parse_resolution(encoding.resolution)) for encoding in encodings]
+        psnr_values = await _calculate_psnr_batch(all_inputs, reference_path, duration, threads)
+        if psnr_values is not None:
+            keep = _find_undominated(encodings, psnr_values)
+            for i in range(len(encodings)):
+                if not keep[i]:
+                    logger.info(
+                        f"Skipping VMAF for {os.path.basename(encodings[i].path)}: "
+                        f"dominated by a lower bitrate (PSNR={psnr_values[i]:.2f})"
+                    )
+            selected = [i for i in selected if keep[i]]
+
+    measured = await _measure_segment_vmaf(
+        [encodings[i] for i in selected], reference_path, duration, threads, subsample, gpu
+    )
+    for i, metric in zip(selected, measured):
+        metrics[i] = metric
+    return metrics
+
+
+async def _measure_segment_vmaf(  # noqa: PLR0913 Too many arguments
+    encodings: List[TestEncoding],
+    reference_path: str,
+    duration: float,
+    threads: int,
+    subsample: int,
+    gpu: bool,
+) -> List[Optional[QualityMetric]]:
+    """
+    Calculate VMAF and PSNR for test encodings of one segment.
+
+    All encodings are measured in one FFmpeg run, on the GPU if requested. If the GPU run fails,
+    the segment is measured on the CPU. If that run fails too, for example because one of the
+    encodings is broken, each encoding is measured on its own so the others still count.
+
+    Args:
+        encodings: Test encodings of the segment
+        reference_path: Path to the decoded reference segment
+        duration: Duration of the segment in seconds
+        threads: Number of FFmpeg threads to use
+        subsample: Compute the metrics on every n-th frame only
+        gpu: Try computing VMAF with libvmaf_cuda first
+
+    Returns:
+        QualityMetric per encoding (in the given order), None for encodings that could not be measured
+    """
+    names = ", ".join(os.path.basename(encoding.path) for encoding in encodings)
+    logger.info(f"Calculating VMAF and PSNR for {names}")
+
+    inputs = [(encoding.path, parse_resolution(encoding.resolution)) for encoding in encodings]
+    vmaf_results = None
+    if gpu:
+        vmaf_results = await _calculate_vmaf_batch(inputs, reference_path, duration, threads, subsample, gpu=True)
+        if vmaf_results is None:
+            logger.warning("GPU VMAF calculation failed, falling back to CPU libvmaf")
+    if vmaf_results is None:
+        vmaf_results = await _calculate_vmaf_batch(inputs, reference_path, duration, threads, subsample)
+    if vmaf_results is None and len(encodings) > 1:
+        logger.warning("Falling back to measuring the encodings of this segment one by one")
+        vmaf_results = [
+            await _calculate_vmaf(path, reference_path, duration, threads, resolution, subsample)
+            for path, resolution in inputs
+        ]
+    elif vmaf_results is None:
+        vmaf_results = [None]
+
+    return [_build_quality_metric(encoding, vmaf_result) for encoding, vmaf_result in zip(encodings, vmaf_results)]
+
+
+def _plan_concurrency(num_segments: int, jobs: Optional[int]) -> Tuple[int, int]:
+    """
+    Determine how many segments to measure concurrently and how many threads each FFmpeg child gets.
+
+    Args:
+        num_segments: Number of segments to measure
+        jobs: Requested number of concurrent jobs, or None to derive it from the usable CPUs
+
+    Returns:
+        Tuple of (workers, threads_per_job) such that workers * threads_per_job is roughly the usable CPUs,
+        unless the threads per job are set through the ENCODEX_VMAF_THREADS environment variable
+    """
+    cpu_count = available_cpus()
+    if not jobs or jobs < 1:
+        jobs = max(1, cpu_count // _DEFAULT_THREADS_PER_JOB)
+
+    workers = max(1, min(jobs, num_segments))
+    threads_per_job = max(1, cpu_count // workers)
+
+    # Allow overriding the thread count per job, e.g. when other work shares the machine
+    threads_per_job = positive_int_from_env(_VMAF_THREADS_ENV) or threads_per_job
+
+    return workers, threads_per_job
+
+
+async def _measure_encodings(  # noqa: PLR0913 Too many arguments
+    tasks: List[Tuple[TestEncoding, float, float]],
+    input_file: str,
+    reference_resolution: Optional[Tuple[int, int]],
+    reference_dir: str,
+    workers: int,
+    threads: int,
+    subsample: int,
+    gpu: bool = False,
+    psnr_prefilter: bool = False,
+) -> List[Optional[QualityMetric]]:
+    """
+    Decode the reference segments and measure all test encodings concurrently.
+
+    Segments are processed as a pipeline: each one is decoded, measured and its reference removed
+    before the next segment takes its place, so at most `workers` references exist at a time.
+
+    Args:
+        tasks: Tuples of (encoding, start_time, duration) to measure
+        input_file: Path to the original video
+        reference_resolution: Resolution of the original video, if known
+        reference_dir: Directory for the decoded reference segments
+        workers: Maximum number of FFmpeg processes running at the same time
+        threads: Number of FFmpeg threads per process
+        subsample: Compute the metrics on every n-th frame only
+        gpu: Try computing VMAF with libvmaf_cuda first
+        psnr_prefilter: Skip VMAF for encodings whose PSNR is dominated by a lower bitrate
+
+    Returns:
+        Quality metric per measured encoding in input order, None for encodings that failed
+    """
+    semaphore = asyncio.Semaphore(workers)
+
+    async def measure_segment(
+        start_time: float, duration: float, indices: List[int], reference_path: str
+    ) -> List[Optional[QualityMetric]]:
+        encodings = [tasks[i][0] for i in indices]
+        async with semaphore:
+            # Decode the segment of the original video once; the decoded reference is
+            # shared by all test encodings of that segment.
+            logger.info(f"Decoding reference segment {start_time:.2f}s (+{duration:.2f}s) to {reference_path}")
+            try:
+                if not await _decode_reference_segment(
+                    input_file, start_time, duration, reference_path, threads, reference_resolution
+                ):
+                    for encoding in encodings:
+                        logger.error(
+                            f"Skipping {os.path.basename(encoding.path)}: reference segment could not be decoded"
+                        )
+                    return [None] * len(encodings)
+
+                # Measure all encodings of the segment together
+                logger.info(f"Processing {len(indices)} encodings of segment {start_time:.2f}s (+{duration:.2f}s)")
+                return await _process_segment(
+                    encodings, reference_path, duration, threads, subsample, gpu, psnr_prefilter
+                )
+            finally:
+                # The raw reference is large, so remove it as soon as its segment is done
+                # instead of keeping every decoded segment on disk until the end
+                if os.path.exists(reference_path):
+                    os.remove(reference_path)
+
+    # Group the encodings per segment, remembering their position in the input
+    segments: Dict[Tuple[float, float], List[int]] = {}
+    for i, (_, start_time, duration) in enumerate(tasks):
+        segments.setdefault((start_time, duration), []).append(i)
+
+    segment_results = await asyncio.gather(
+        *(
+            measure_segment(start_time, duration, indices, os.path.join(reference_dir, f"reference_{number:03d}.y4m"))
+            for number, ((start_time, duration), indices) in enumerate(segments.items())
+        )
+    )
+
+    # Put the metrics back in input order
+    results: List[Optional[QualityMetric]] = [None] * len(tasks)
+    for indices, metrics in zip(segments.values(), segment_results):
+        for i, metric in zip(indices, metrics):
+            results[i] = metric
+    return results
+
+
+def _stat_encodings(encodings: List[TestEncoding]) -> List[Optional[os.stat_result]]:
+    """
+    Stat all test encoding files concurrently.
+
+    Args:
+        encodings: Test encodings to check
+
+    Returns:
+        os.stat result per encoding (in the given order), None for files that cannot be accessed
+    """
+
+    def stat(encoding: TestEncoding) -> Optional[os.stat_result]:
+        try:
+            return os.stat(encoding.path)
+        except OSError:
+            return None
+
+    if not encodings:
+        return []
+    with ThreadPoolExecutor(max_workers=min(_MAX_STAT_WORKERS, len(encodings))) as executor:
+        return list(executor.map(stat, encodings))
+
+
+def _open_vmaf_cache() -> Optional[sqlite3.Connection]:
+    """
+    Open the persistent VMAF result cache, creating it if needed.
+
+    Returns:
+        Connection to the cache database, or None if the cache is disabled or unavailable
+    """
+    cache_path = os.environ.get(_VMAF_CACHE_ENV) or _DEFAULT_VMAF_CACHE_PATH
+    if cache_path == "0":
+        return None
+
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(cache_path)), exist_ok=True)
+        cache = sqlite3.connect(cache_path)
+        cache.execute("CREATE TABLE IF NOT EXISTS vmaf_cache (key TEXT PRIMARY KEY, result TEXT NOT NULL)")
+        return cache
+    except (OSError, sqlite3.Error) as e:
+        logger.warning(f"VMAF cache unavailable, measuring all encodings: {str(e)}")
+        return None
+
+
+def _source_fingerprint(input_file: str) -> Optional[str]:
+    """
+    Identify the source video cheaply by hashing its first megabyte, size and modification time.
+
+    Args:
+        input_file: Path to the original video
+
+    Returns:
+        Hex digest identifying the source, or None if the file cannot be read
+    """
+    try:
+        stat = os.stat(input_file)
+        digest = hashlib.blake2b(f"{stat.st_size}:{stat.st_mtime_ns}".encode(), digest_size=16)
+        with open(input_file, "rb") as f:
+            digest.update(f.read(_SOURCE_FINGERPRINT_BYTES))
+        return digest.hexdigest()
+    except OSError:
+        return None
+
+
+def _cache_key(  # noqa: PLR0913 Too many arguments
+    source_fingerprint: str,
+    stat: os.stat_result,
+    encoding: TestEncoding,
+    start_time: float,
+    duration: float,
+    subsample: int,
+    gpu: bool,
+) -> str:
+    """
+    Build the cache key of a test encoding measurement.
+
+    The key changes whenever the source, the encoding file, the segment, the frame subsampling,
+    the libvmaf backend or the VMAF model changes.
+
+    Args:
+        source_fingerprint: Fingerprint of the source video
+        stat: Result of os.stat for the test encoding file
+        encoding: Test encoding
+        start_time: Start time of the segment in seconds
+        duration: Duration of the segment in seconds
+        subsample: Frame subsampling used for the metrics
+        gpu: Whether the metrics are computed with libvmaf_cuda instead of CPU libvmaf
+
+    Returns:
+        Cache key
+    """
+    fields = (
+        source_fingerprint,
+        os.path.abspath(encoding.path),
+        stat.st_size,
+        stat.st_mtime_ns,
+        start_time,
+        duration,
+        subsample,
+        "libvmaf_cuda" if gpu else "libvmaf",
+        VMAF_MODEL,
+    )
+    return hashlib.blake2b(json.dumps(fields).encode(), digest_size=16).hexdigest()
+
+
+def _load_cached_metrics(cache: sqlite3.Connection, keys: List[Optional[str]]) -> Dict[str, Dict]:
+    """
+    Look up previously measured results in the cache.
+
+    Args:
+        cache: Connection to the cache database
+        keys: Cache keys to look up (None entries are ignored)
+
+    Returns:
+        Dictionary mapping cache keys to the cached VMAF/PSNR results
+    """
+    cached = {}
+    for key in keys:
+        if key is None:
+            continue
+        row = cache.execute("SELECT result FROM vmaf_cache WHERE key = ?", (key,)).fetchone()
+        if row:
+            cached[key] = json.loads(row[0])
+    return cached
+
+
+def _store_cached_metrics(cache: sqlite3.Connection, entries: List[Tuple[str, QualityMetric]]) -> None:
+    """
+    Store newly measured results in the cache.
+
+    Args:
+        cache: Connection to the cache database
+        entries: Tuples of (cache_key, quality_metric) to store
+    """
+    try:
+        with cache:
+            cache.executemany(
+                "INSERT OR REPLACE INTO vmaf_cache (key, result) VALUES (?, ?)",
+                [(key, json.dumps({"vmaf": metric.vmaf, "psnr": metric.psnr})) for key, metric in entries],
+            )
+    except sqlite3.Error as e:
+        logger.warning(f"Could not update VMAF cache: {str(e)}")
+
+
+def calculate_quality_metrics(
+    state: EnCodexState, jobs: Optional[int] = None, psnr_prefilter: bool = False
+) -> EnCodexState:
     """
     Calculates quality metrics for test encodings.
 
     Args:
         state: Current workflow state
+        jobs: Number of segments to measure concurrently. Defaults to a value derived from the CPU count.
+        psnr_prefilter: Measure PSNR first and skip VMAF for encodings that are dominated by a lower
+                        bitrate of the same segment. These encodings get no quality metric.
 
     Returns:
         Updated workflow state with quality metrics
@@ -211,10 +926,16 @@ def calculate_quality_metrics(state: EnCodexState) -> EnCodexState:
     logger.info("Starting quality metrics calculation node.")
     logger.info(f"Found {len(state.test_encodings)} test encodings to process.")
 
-    # Calculate quality metrics for each test encoding
-    for i, encoding in enumerate(state.test_encodings, 1):
-        # Log progress
-        logger.info(f"Processing encoding {i}/{len(state.test_encodings)}: {encoding.path}")
+    # Check all files up front, so a missing encoding cannot fail the batched FFmpeg run of its segment
+    encoding_stats = _stat_encodings(state.test_encodings)
+
+    # Collect the encodings that exist and have a valid segment time range
+    tasks: List[Tuple[TestEncoding, float, float]] = []
+    stats: List[os.stat_result] = []
+    for encoding, encoding_stat in zip(state.test_encodings, encoding_stats):
+        if encoding_stat is None:
+            logger.error(f"Test encoding not found, skipping quality metrics: {encoding.path}")
+            continue
 
         # Extract segment time range
         start_time, duration = _extract_segment_time_range(encoding.segment)
@@ -224,49 +945,78 @@ def calculate_quality_metrics(state: EnCodexState) -> EnCodexState:
             logger.warning(f"Skipping quality metrics for encoding with invalid segment ID: {encoding.segment}")
             continue
 
-        # Calculate VMAF
-        logger.info(f"Calculating VMAF for {os.path.basename(encoding.path)} (segment {encoding.segment})")
-        vmaf_result = _calculate_vmaf(
-            test_encoding_path=encoding.path,
-            original_video_path=state.input_file,
-            start_time=start_time,
-            duration=duration,
-        )
+        tasks.append((encoding, start_time, duration))
+        stats.append(encoding_stat)
 
-        # Skip if VMAF calculation failed
-        if not vmaf_result:
-            logger.error(f"Failed to calculate VMAF for {os.path.basename(encoding.path)}")
-            continue
+    # Resolution of the original video, used to skip rescaling the reference if it is already at the metric resolution
+    reference_resolution = None
+    if state.video_metadata and state.video_metadata.width and state.video_metadata.height:
+        reference_resolution = (state.video_metadata.width, state.video_metadata.height)
 
-        # Calculate PSNR separately
-        logger.info(f"Calculating PSNR for {os.path.basename(encoding.path)} (segment {encoding.segment})")
-        psnr_value = _calculate_psnr(
-            test_encoding_path=encoding.path,
-            original_video_path=state.input_file,
-            start_time=start_time,
-            duration=duration,
-        )
+    if tasks:
+        subsample = vmaf_subsample()
+        gpu = _use_vmaf_gpu()
+        results: List[Optional[QualityMetric]] = [None] * len(tasks)
 
-        # Use -1.0 as fallback if PSNR calculation failed
-        if psnr_value is None:
-            logger.warning(f"Using default PSNR value for {os.path.basename(encoding.path)}")
-            psnr_value = -1.0
-
-        # Log results
-        logger.info(
-            (
-                f"Calculated metrics for {os.path.basename(encoding.path)}: "
-                "VMAF={vmaf_result['vmaf']:.2f}, PSNR={psnr_value:.2f}"
+        # Encodings that were measured while they were created (fused metrics) need no further measurement
+        for i, (encoding, _, _) in enumerate(tasks):
+            if encoding.vmaf is not None:
+                logger.info(f"Using metrics measured during encoding for {os.path.basename(encoding.path)}")
+                results[i] = _build_quality_metric(encoding, {"vmaf": encoding.vmaf, "psnr": encoding.psnr})
+        measured_while_encoding = [i for i, metric in enumerate(results) if metric is not None]
+
+        # Reuse the results of encodings that were already measured in a previous run
+        cache = _open_vmaf_cache()
+        keys: List[Optional[str]] = [None] * len(tasks)
+        if cache:
+            source_fingerprint = _source_fingerprint(state.input_file)
+            if source_fingerprint:
+                keys = [_cache_key(source_fingerprint, stat, *task, subsample, gpu) for task, stat in zip(tasks, stats)]
+            cached = _load_cached_metrics(cache, keys)
+            for i, key in enumerate(keys):
+                if key in cached and results[i] is None:
+                    logger.info(f"Using cached metrics for {os.path.basename(tasks[i][0].path)}")
+                    results[i] = _build_quality_metric(tasks[i][0], cached[key])
+        pending = [i for i, metric in enumerate(results) if metric is None]
+
+        if pending:
+            pending_tasks = [tasks[i] for i in pending]
+            num_segments = len({(start_time, duration) for _, start_time, duration in pending_tasks})
+            workers, threads = _plan_concurrency(num_segments, jobs)
+            logger.info(
+                f"Measuring {len(pending_tasks)} encodings of {num_segments} segments with {workers} concurrent jobs "
+                f"({threads} FFmpeg threads each)."
             )
-        )
 
-        # Create quality metric object
-        quality_metric = QualityMetric(
-            encoding_id=os.path.basename(encoding.path), vmaf=vmaf_result["vmaf"], psnr=psnr_value
-        )
+            # Supervise all FFmpeg processes from a single event loop; the decoded
+            # reference segments are removed when we are done.
+            with tempfile.TemporaryDirectory(prefix="encodex_ref_") as reference_dir:
+                measured = asyncio.run(
+                    _measure_encodings(
+                        pending_tasks,
+                        state.input_file,
+                        reference_resolution,
+                        reference_dir,
+                        workers,
+                        threads,
+                        subsample,
+                        gpu,
+                        psnr_prefilter,
+                    )
+                )
+            for i, metric in zip(pending, measured):
+                results[i] = metric
+
+        if cache:
+            # Metrics measured while encoding come from CPU libvmaf, so they only match the key of a CPU run
+            new_results = (measured_while_encoding if not gpu else []) + pending
+            _store_cached_metrics(
+                cache, [(keys[i], results[i]) for i in new_results if keys[i] is not None and results[i] is not None]
+            )
+            cache.close()
 
-        # Add to quality metrics list
-        state.quality_metrics.append(quality_metric)
+        # Drop the encodings that could not be measured
+        state.quality_metrics = [metric for metric in results if metric is not None]
 
     # Check if we successfully calculated any quality metrics
     if not state.quality_metrics:
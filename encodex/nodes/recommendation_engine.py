@@ -5,15 +5,19 @@ This node analyzes quality metrics using the convex hull approach to generate
 optimal encoding parameters based on content complexity.
 """
 
+import functools
 import logging
 from typing import Dict, List, Tuple
 
+import numpy as np
+
 from encodex.graph_state import ComplexityCategory, EnCodexState, EncodingParameters, QualityMetric
 
 # Set up logger
 logger = logging.getLogger(__name__)
 
 
+@functools.lru_cache(maxsize=256)
 def _parse_encoding_id(encoding_id: str) -> Tuple[str, int]:
     """
     Parse the encoding ID to extract resolution and bitrate.
@@ -46,26 +50,40 @@ def _compute_convex_hull(quality_metrics: List[QualityMetric]) -> List[Dict]:
         List of points on the convex hull
     """
     logger.info("Computing convex hull from quality metrics...")
-
-    # Parse encoding_id to extract resolution and bitrate
-    parsed_metrics = []
-    for metric in quality_metrics:
-        resolution, bitrate = _parse_encoding_id(metric.encoding_id)
-        parsed_metrics.append(
-            {"encoding_id": metric.encoding_id, "resolution": resolution, "bitrate": bitrate, "vmaf": metric.vmaf}
+    if not quality_metrics:
+        return []
+
+    # Collect resolution and bitrate into parallel arrays, parsing the encoding_id only
+    # for metrics that were created without them
+    encoding_ids = [metric.encoding_id for metric in quality_metrics]
+    resolutions, bitrates = zip(
+        *(
+            (metric.resolution, metric.bitrate_kbps)
+            if metric.resolution is not None and metric.bitrate_kbps is not None
+            else _parse_encoding_id(metric.encoding_id)
+            for metric in quality_metrics
         )
-
-    # Sort by bitrate
-    sorted_metrics = sorted(parsed_metrics, key=lambda x: x["bitrate"])
-
-    # Compute convex hull (upper envelope)
-    hull_points = []
-    max_vmaf_so_far = -float("inf")
-
-    for point in sorted_metrics:
-        if point["vmaf"] > max_vmaf_so_far:
-            hull_points.append(point)
-            max_vmaf_so_far = point["vmaf"]
+    )
+    bitrate_array = np.array(bitrates, dtype=np.int64)
+    vmaf_array = np.array([metric.vmaf for metric in quality_metrics], dtype=np.float64)
+
+    # Sort by bitrate (stable, so equal bitrates keep their input order)
+    order = np.argsort(bitrate_array, kind="stable")
+    sorted_vmaf = vmaf_array[order]
+
+    # Compute convex hull (upper envelope): keep the points that beat the best VMAF of all lower bitrates
+    best_before = np.concatenate(([-np.inf], np.maximum.accumulate(sorted_vmaf)[:-1]))
+    hull_indices = order[sorted_vmaf > best_before]
+
+    hull_points = [
+        {
+            "encoding_id": encoding_ids[i],
+            "resolution": resolutions[i],
+            "bitrate": int(bitrate_array[i]),
+            "vmaf": float(vmaf_array[i]),
+        }
+        for i in hull_indices
+    ]
 
     logger.info(f"Found {len(hull_points)} points on the convex hull.")
 
@@ -138,6 +156,7 @@ def _get_adjustment_factor(complexity: ComplexityCategory) -> float:
         return 1.0  # Default
 
 
+@functools.lru_cache(maxsize=256)
 def _select_profile(resolution: str) -> str:
     """
     Select H.264 profile based on resolution.
@@ -5,141 +5,232 @@ This node generates test encodings for selected video segments using different
 encoding parameters to evaluate quality vs. bitrate tradeoffs.
 """
 
+import asyncio
+import functools
 import logging
 import os
-import platform  # Add platform import
-import re  # Add re import for parsing progress
+import re
 import subprocess
 import sys  # Add sys import for stdout flushing
-from typing import List, Optional
+import tempfile
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
 
+from encodex.ffmpeg_utils import available_cpus, escape_tee_path
 from encodex.graph_state import EnCodexState, TestEncoding
+from encodex.vmaf import VMAF_FILTER, build_scale_filter, parse_resolution, read_vmaf_logs, vmaf_subsample
 
 logger = logging.getLogger(__name__)
 
+# Threads assumed per concurrent encode when deriving the number of jobs from the usable CPUs
+_DEFAULT_THREADS_PER_ENCODE = 4
 
-def _run_ffmpeg_command(cmd: List[str], duration_s: float) -> Optional[str]:
+# Hardware H.264 encoders in order of preference, used when GPU encoding is requested
+_HW_ENCODERS = ["h264_videotoolbox", "h264_nvenc", "h264_qsv", "h264_vaapi"]
+_CPU_ENCODER = "libx264"
+
+# Render node used by the VAAPI encoder
+_VAAPI_DEVICE = "/dev/dri/renderD128"
+
+# Current position (microseconds) reported by FFmpeg's -progress output
+_PROGRESS_RE = re.compile(rb"out_time_us=(\d+)")
+
+# Minimum seconds between two progress line updates
+_PROGRESS_INTERVAL = 1.0
+
+# Seconds encoded from the middle of each segment, which is enough to rank the ladder of a shot
+_PROBE_DURATION = 3.0
+
+
+def _probe_range(start_time: float, end_time: float) -> Tuple[float, float]:
     """
-    Run an FFmpeg command, print progress, and return error message if failed.
+    Determine the short probe in the middle of a segment that is encoded instead of the whole segment.
 
     Args:
-        cmd: FFmpeg command as a list of strings. Must include '-progress pipe:1'.
-        duration_s: Duration of the input segment in seconds for progress calculation.
+        start_time: Start of the segment in seconds
+        end_time: End of the segment in seconds
 
     Returns:
-        Error message if command failed, None otherwise.
+        Tuple of (start_time, end_time) of the probe
     """
-    logger.info(f"Executing FFmpeg command: {' '.join(cmd)}")
-    process = subprocess.Popen(
-        cmd,
-        stdout=subprocess.PIPE,  # Capture progress from stdout
-        stderr=subprocess.PIPE,  # Capture errors from stderr
-        text=True,  # Decode output as text
-        encoding="utf-8",  # Specify encoding
-        bufsize=1,  # Line buffered
-    )
+    probe_duration = min(_PROBE_DURATION, end_time - start_time)
+    # Round like the segment ID, so the quality metrics decode exactly the encoded range of the source
+    probe_start = round(start_time + (end_time - start_time - probe_duration) / 2, 2)
+    return probe_start, round(probe_start + probe_duration, 2)
+
+
+def _cpu_sets(workers: int) -> List[Optional[Set[int]]]:
+    """
+    Split the usable CPUs into disjoint sets, one per concurrent encode job.
+
+    Pinning each job to its own CPUs keeps the encoder threads of concurrent jobs from
+    competing for the same cores and their caches.
+
+    Args:
+        workers: Number of concurrent encode jobs
+
+    Returns:
+        CPU set per job, or None per job where pinning is not supported or not useful
+    """
+    try:
+        cpus = sorted(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        # sched_getaffinity is not available on macOS and Windows
+        return [None] * workers
+    cpus_per_worker = len(cpus) // workers
+    if workers < 2 or cpus_per_worker < 1:
+        return [None] * workers
+    return [set(cpus[i * cpus_per_worker : (i + 1) * cpus_per_worker]) for i in range(workers)]
+
+
+def _pin_to(cpus: Optional[Set[int]]) -> Optional[Callable[[], None]]:
+    """
+    Create a function that restricts a child process to the given CPUs before it starts.
+
+    Args:
+        cpus: CPUs to run on, None to leave the affinity unchanged
+
+    Returns:
+        preexec_fn for the subprocess, or None
+    """
+    return functools.partial(os.sched_setaffinity, 0, cpus) if cpus else None
+
+
+async def _report_progress(stream: asyncio.StreamReader, duration_s: float, show_progress: bool) -> None:
+    """
+    Consume the '-progress pipe:1' output of FFmpeg and print the progress.
 
+    Args:
+        stream: stdout of the FFmpeg process
+        duration_s: Duration of the input segment in seconds for progress calculation.
+        show_progress: Print a progress line, otherwise the output is only drained.
+    """
     total_duration_us = duration_s * 1000000 if duration_s > 0 else None
-    # last_progress_line = "" # Removed unused variable
 
-    # Read progress from stdout
+    # Read progress in large raw chunks instead of line by line. Only the last complete
+    # 'out_time_us' entry of each chunk matters, so it is located with rfind and only it is parsed.
+    last_print = 0.0
+    pending = b""
     while True:
-        if process.stdout is None:
-            break
-        line = process.stdout.readline()
-        if not line:
+        data = await stream.read(65536)
+        if not data:
             break
 
-        # Simple parsing for 'out_time_us' (microseconds)
-        match = re.search(r"out_time_us=(\d+)", line)
+        # Keep an incomplete trailing line for the next read
+        complete, _, pending = (pending + data).rpartition(b"\n")
+        pos = complete.rfind(b"out_time_us=")
         # Ensure total_duration_us is valid (positive) before calculating progress
-        if match and total_duration_us and total_duration_us > 0:
+        if not show_progress or pos == -1 or not total_duration_us:
+            continue
+
+        match = _PROGRESS_RE.match(complete, pos)
+        now = time.monotonic()
+        # Limit the terminal updates, FFmpeg may report progress more often than useful
+        if match and now - last_print >= _PROGRESS_INTERVAL:
             current_us = int(match.group(1))
             progress = min(100.0, (current_us / total_duration_us) * 100)  # Cap at 100%
             # Print progress on the same line
-            progress_line = f"\rProgress: {progress:.1f}%"
-            print(progress_line, end="")
-            # last_progress_line = progress_line # No longer needed for clearing
+            print(f"\rProgress: {progress:.1f}%", end="")
             sys.stdout.flush()  # Ensure it prints immediately
-        # Removed explicit handling of 'progress=end' within the loop
+            last_print = now
 
-    # Wait for the process to finish and capture remaining output/errors
-    stdout, stderr = process.communicate()
+    if show_progress:
+        # Clear the progress line after the process completes
+        # Use a sufficiently long string of spaces to ensure overwriting
+        print("\r" + " " * 80 + "\r", end="")
+        sys.stdout.flush()
+        print()  # Add a newline for subsequent logs
+
+
+async def _run_ffmpeg_command(
+    cmd: List[str], duration_s: float, show_progress: bool = True, cpus: Optional[Set[int]] = None
+) -> Optional[str]:
+    """
+    Run an FFmpeg command, print progress, and return error message if failed.
+
+    Args:
+        cmd: FFmpeg command as a list of strings. Must include '-progress pipe:1'.
+        duration_s: Duration of the input segment in seconds for progress calculation.
+        show_progress: Print a progress line. Disabled when several encodes run concurrently,
+                       as their progress lines would overwrite each other.
+        cpus: CPUs to pin the FFmpeg process to, None to run it on any CPU.
+
+    Returns:
+        Error message if command failed, None otherwise.
+    """
+    logger.info(f"Executing FFmpeg command: {' '.join(cmd)}")
+    process = await asyncio.create_subprocess_exec(
+        *cmd,
+        stdout=asyncio.subprocess.PIPE,  # Capture progress from stdout
+        stderr=asyncio.subprocess.PIPE,  # Capture errors from stderr
+        preexec_fn=_pin_to(cpus),
+    )
 
-    # Clear the progress line after the process completes
-    # Use a sufficiently long string of spaces to ensure overwriting
-    print("\r" + " " * 80 + "\r", end="")
-    sys.stdout.flush()
-    print()  # Add a newline for subsequent logs
+    # Read both pipes concurrently so neither can fill up and block FFmpeg
+    _, stderr = await asyncio.gather(_report_progress(process.stdout, duration_s, show_progress), process.stderr.read())
+    await process.wait()
 
     if process.returncode != 0:
-        error_message = f"FFmpeg error (Exit Code {process.returncode}): {stderr.strip()}"
+        error_message = f"FFmpeg error (Exit Code {process.returncode}): {stderr.decode(errors='replace').strip()}"
         logger.debug(error_message)  # Log the detailed error at debug level
         return error_message
     else:
         return None  # Success
 
 
-def _create_test_encoding(  # noqa: PLR0913 Too many arguments
-    input_file: str,
-    segment: dict,
-    resolution: str,
-    bitrate: int,
-    output_dir: str,
-    use_gpu: bool = False,
-) -> Optional[TestEncoding]:
+@functools.lru_cache(maxsize=None)
+def _detect_hw_encoder() -> Optional[str]:
+    """
+    Check once which hardware H.264 encoder the local FFmpeg build includes.
+
+    Returns:
+        Name of the preferred hardware encoder, or None if there is none
     """
-    Create a test encoding for a specific segment with given parameters.
+    try:
+        result = subprocess.run(["ffmpeg", "-hide_banner", "-encoders"], capture_output=True, text=True)
+    except OSError:
+        return None
+
+    available = {line.split()[1] for line in result.stdout.splitlines() if len(line.split()) > 1}
+    return next((encoder for encoder in _HW_ENCODERS if encoder in available), None)
+
+
+def _scale_filter(encoder: str, width: str, height: str) -> str:
+    """
+    Build the scale filter for one test encoding.
 
     Args:
-        input_file: Path to the original video file
-        segment: Segment dict with start_time and end_time
-        resolution: Resolution as WIDTHxHEIGHT string
-        bitrate: Target bitrate in kbps
-        output_dir: Directory to store output files
+        encoder: Name of the video encoder
+        width: Target width
+        height: Target height
 
     Returns:
-        TestEncoding object if successful, None if failed
+        Video filter for the -vf option
     """
-    segment_id = f"{segment['start_time']:.2f}-{segment['end_time']:.2f}"
-    logger.info(f"Creating test encoding for segment {segment_id} at {resolution} {bitrate}k...")
+    if encoder == "h264_vaapi":
+        # VAAPI encodes GPU surfaces, so upload the frames and scale them on the GPU
+        return f"format=nv12,hwupload,scale_vaapi=w={width}:h={height}"
+    return f"scale={width}:{height}"
 
-    # Create output directory if it doesn't exist
-    os.makedirs(output_dir, exist_ok=True)
 
-    # Parse resolution
-    width, height = resolution.split("x")
+def _encoder_args(encoder: str, bitrate: int, threads: int) -> List[str]:
+    """
+    Build the video encoder options for one test encoding.
 
-    # Generate output filename based on parameters
-    output_filename = f"test_encoding_{segment_id}_{resolution}_{bitrate}k.mp4"
-    output_path = os.path.join(output_dir, output_filename)
-    logger.debug(f"Output path: {output_path}")
+    Args:
+        encoder: Name of the video encoder
+        bitrate: Target bitrate in kbps
+        threads: Number of libx264 threads (hardware encoders manage their own parallelism)
 
+    Returns:
+        FFmpeg output options selecting and configuring the encoder
+    """
     # Calculate maxrate and bufsize (standard practice)
     maxrate = int(bitrate * 1.5)
     bufsize = bitrate * 2
 
-    # Calculate segment duration for progress
-    segment_duration = segment["end_time"] - segment["start_time"]
-
-    # Base FFmpeg command parts
-    base_cmd = [
-        "ffmpeg",
-        "-progress",
-        "pipe:1",
-        "-i",
-        input_file,
-        "-ss",
-        str(segment["start_time"]),
-        "-to",
-        str(segment["end_time"]),
-    ]
-
-    # Video codec specific parts
-    encoder_cmd = []
-    if use_gpu and platform.system() == "Darwin":
-        logger.info("Attempting to use hardware encoder (h264_videotoolbox)...")
-        encoder_cmd = [
+    if encoder == "h264_videotoolbox":
+        return [
             "-c:v",
             "h264_videotoolbox",
             "-allow_sw",
@@ -151,61 +242,372 @@ def _create_test_encoding(  # noqa: PLR0913 Too many arguments
             # Bufsize might not be directly applicable or behave differently
             # Preset is not applicable
         ]
-    else:
-        if use_gpu and platform.system() != "Darwin":
-            logger.warning(
-                "GPU acceleration requested, but only macOS VideoToolbox is currently supported. Falling back to CPU."
-            )
+
+    rate_control = ["-b:v", f"{bitrate}k", "-maxrate", f"{maxrate}k", "-bufsize", f"{bufsize}k"]
+    if encoder == "h264_nvenc":
+        return ["-c:v", "h264_nvenc", "-preset", "p4", "-rc", "vbr", *rate_control]
+    if encoder == "h264_qsv":
+        return ["-c:v", "h264_qsv", "-preset", "faster", *rate_control]
+    if encoder == "h264_vaapi":
+        return ["-c:v", "h264_vaapi", *rate_control]
+
+    return [
+        "-c:v",
+        "libx264",
+        "-b:v",
+        f"{bitrate}k",
+        "-maxrate",
+        f"{maxrate}k",
+        "-bufsize",
+        f"{bufsize}k",
+        "-preset",
+        "faster",  # Test encodings only need the relative quality ordering of the ladder
+        # A shorter rate control lookahead than the preset's is plenty for the short test probes
+        "-x264-params",
+        "rc-lookahead=10",
+        # Without a limit every x264 instance starts threads for all CPUs, which thrashes with concurrent jobs
+        "-threads",
+        str(threads),
+    ]
+
+
+async def _create_test_encodings(  # noqa: PLR0913 Too many arguments
+    input_file: str,
+    segment: dict,
+    params_list: List[dict],
+    output_dir: str,
+    use_gpu: bool = False,
+    show_progress: bool = True,
+    threads: int = 0,
+    cpus: Optional[Set[int]] = None,
+) -> List[Optional[TestEncoding]]:
+    """
+    Create the test encodings of one segment with a single FFmpeg command.
+
+    The segment is decoded once and every resolution/bitrate pair becomes a separate output
+    of the same command, instead of decoding the segment again for each test encoding.
+
+    Args:
+        input_file: Path to the original video file
+        segment: Segment dict with start_time and end_time
+        params_list: Encoding parameters, dicts with resolution (WIDTHxHEIGHT) and bitrate (kbps)
+        output_dir: Existing directory to store output files
+        use_gpu: If True, use the hardware encoder of the FFmpeg build if there is one
+        show_progress: Print the FFmpeg progress while encoding
+        threads: Number of CPU threads for the whole command, shared by its encoders (0 lets FFmpeg decide)
+        cpus: CPUs to pin the FFmpeg process to, None to run it on any CPU
+
+    Returns:
+        TestEncoding per parameter set (in the given order), None for all of them if the command failed
+    """
+    segment_id = f"{segment['start_time']:.2f}-{segment['end_time']:.2f}"
+    ladder = ", ".join(f"{params['resolution']} {params['bitrate']}k" for params in params_list)
+    logger.info(f"Creating test encodings for segment {segment_id} at {ladder}...")
+
+    encoder = _CPU_ENCODER
+    if use_gpu:
+        encoder = _detect_hw_encoder() or _CPU_ENCODER
+        if encoder == _CPU_ENCODER:
+            logger.warning("GPU acceleration requested, but FFmpeg has no supported hardware encoder. Using CPU.")
+    if encoder == _CPU_ENCODER:
         logger.info("Using CPU encoder (libx264)...")
-        encoder_cmd = [
-            "-c:v",
-            "libx264",
-            "-b:v",
-            f"{bitrate}k",
-            "-maxrate",
-            f"{maxrate}k",
-            "-bufsize",
-            f"{bufsize}k",
-            "-preset",
-            "slow",  # Higher quality encoding for tests
-        ]
+    else:
+        logger.info(f"Attempting to use hardware encoder ({encoder})...")
 
-    # Scaling and output parts
-    output_cmd = [
-        "-vf",
-        f"scale={width}:{height}",
-        "-an",  # No audio needed for test segments
+    # Calculate segment duration for progress
+    segment_duration = segment["end_time"] - segment["start_time"]
+
+    # Seek on the input so the segment is decoded only once for all outputs
+    cmd = [
+        "ffmpeg",
+        "-progress",
+        "pipe:1",
+        # Keep the stats line and banner off stderr so it only carries errors and cannot fill up while we read stdout
+        "-nostats",
+        "-loglevel",
+        "error",
         "-y",  # Overwrite existing files
-        output_path,
+        *(["-vaapi_device", _VAAPI_DEVICE] if encoder == "h264_vaapi" else []),
+        "-ss",
+        str(segment["start_time"]),
+        "-t",
+        str(segment_duration),
+        "-i",
+        input_file,
     ]
 
-    # Combine command parts
-    final_cmd = base_cmd + encoder_cmd + output_cmd
+    # Every output runs its own encoder, so split the thread budget between them
+    encoder_threads = max(1, threads // len(params_list)) if threads else 0
+
+    output_paths = []
+    for params in params_list:
+        resolution = params["resolution"]
+        bitrate = params["bitrate"]
+
+        # Parse resolution
+        width, height = resolution.split("x")
+
+        # Generate output filename based on parameters
+        output_filename = f"test_encoding_{segment_id}_{resolution}_{bitrate}k.mp4"
+        output_path = os.path.join(output_dir, output_filename)
+        logger.debug(f"Output path: {output_path}")
+        output_paths.append(output_path)
+
+        # Scaling, encoder and output parts of this output
+        cmd += [
+            "-map",
+            "0:v:0",
+            "-vf",
+            _scale_filter(encoder, width, height),
+            *_encoder_args(encoder, bitrate, encoder_threads),
+            "-an",  # No audio needed for test segments
+            output_path,
+        ]
 
     # Run FFmpeg command and capture potential error
-    error_message = _run_ffmpeg_command(final_cmd, segment_duration)
+    error_message = await _run_ffmpeg_command(cmd, segment_duration, show_progress, cpus)
+
+    if error_message and encoder != _CPU_ENCODER:
+        # The encoder can be compiled in without a usable device, e.g. NVENC on a machine without an NVIDIA GPU
+        logger.warning(f"Hardware encoder {encoder} failed for segment {segment_id}, retrying with libx264.")
+        return await _create_test_encodings(
+            input_file, segment, params_list, output_dir, False, show_progress, threads, cpus
+        )
 
     if error_message:  # Check if an error message string was returned
-        # Progress line clearing is now handled within _run_ffmpeg_command after communicate()
-        logger.error(
-            f"Failed to create test encoding for segment {segment_id} ({resolution} {bitrate}k): {error_message}"
+        logger.error(f"Failed to create test encodings for segment {segment_id} ({ladder}): {error_message}")
+        return [None] * len(params_list)
+
+    logger.info(f"Successfully created test encodings: {', '.join(output_paths)}")
+
+    # Return TestEncoding objects
+    return [
+        TestEncoding(path=output_path, resolution=params["resolution"], bitrate=params["bitrate"], segment=segment_id)
+        for output_path, params in zip(output_paths, params_list)
+    ]
+
+
+def _stream_args(args: List[str], index: int) -> List[str]:
+    """
+    Restrict encoder options to one output stream by adding a stream specifier to every option name.
+
+    Args:
+        args: Encoder options as built by _encoder_args
+        index: Index of the output stream
+
+    Returns:
+        Options that only apply to the given stream (e.g. "-b:v" becomes "-b:2")
+    """
+    return [f"{arg.split(':')[0]}:{index}" if arg.startswith("-") else arg for arg in args]
+
+
+async def _create_measured_test_encodings(  # noqa: PLR0913 Too many arguments
+    input_file: str,
+    segment: dict,
+    params_list: List[dict],
+    output_dir: str,
+    reference_resolution: Optional[Tuple[int, int]] = None,
+    show_progress: bool = True,
+    threads: int = 0,
+    cpus: Optional[Set[int]] = None,
+) -> Optional[List[Optional[TestEncoding]]]:
+    """
+    Create the test encodings of one segment and measure their quality in the same pass.
+
+    One FFmpeg process decodes the segment, encodes every rung and writes the encodings to their
+    files. It also streams them, together with the reference at the metric resolution, over a
+    pipe to a second FFmpeg process that computes VMAF and PSNR. The encodings are never read
+    back from disk and the source is decoded only once for encoding and measuring.
+
+    Args:
+        input_file: Path to the original video file
+        segment: Segment dict with start_time and end_time
+        params_list: Encoding parameters, dicts with resolution (WIDTHxHEIGHT) and bitrate (kbps)
+        output_dir: Existing directory to store output files
+        reference_resolution: Resolution of the original video, if known
+        show_progress: Print the FFmpeg progress while measuring
+        threads: Number of CPU threads for both processes (0 lets FFmpeg decide)
+        cpus: CPUs to pin both FFmpeg processes to, None to run them on any CPU
+
+    Returns:
+        TestEncoding with VMAF and PSNR per parameter set (in the given order), or None if the
+        fused run failed
+    """
+    segment_id = f"{segment['start_time']:.2f}-{segment['end_time']:.2f}"
+    segment_duration = segment["end_time"] - segment["start_time"]
+    count = len(params_list)
+    logger.info(f"Creating and measuring test encodings for segment {segment_id} in one pass...")
+
+    # Encoding and measuring run at the same time, so each gets half of the thread budget
+    encoder_threads = max(1, threads // 2 // count) if threads else 0
+    vmaf_threads = max(1, threads // 2 // count) if threads else 1
+
+    # Split the decoded segment into one branch per rung plus the reference at the metric resolution.
+    # Output stream i is rung i, output stream `count` is the raw reference.
+    filters = [f"[0:v]split={count + 1}" + "".join(f"[source{i}]" for i in range(count + 1))]
+    filters.append(build_scale_filter(f"source{count}", "reference_scaled", reference_resolution))
+    filters.append("[reference_scaled]format=yuv420p[reference]")
+    encode_cmd = [
+        "ffmpeg",
+        "-nostats",
+        "-loglevel",
+        "error",
+        "-y",  # Overwrite existing files
+        "-ss",
+        str(segment["start_time"]),
+        "-t",
+        str(segment_duration),
+        "-i",
+        input_file,
+    ]
+    output_paths = []
+    stream_args = []
+    for i, params in enumerate(params_list):
+        width, height = params["resolution"].split("x")
+        filters.append(f"[source{i}]{_scale_filter(_CPU_ENCODER, width, height)}[rung{i}]")
+        encoder_args = _encoder_args(_CPU_ENCODER, params["bitrate"], encoder_threads)
+        stream_args += ["-map", f"[rung{i}]", *_stream_args(encoder_args, i)]
+        output_filename = f"test_encoding_{segment_id}_{params['resolution']}_{params['bitrate']}k.mp4"
+        output_paths.append(os.path.join(output_dir, output_filename))
+
+    # The tee muxer writes every rung to its own file and all streams to the pipe
+    tee_outputs = [f"[select={i}:f=mp4]{escape_tee_path(path)}" for i, path in enumerate(output_paths)]
+    tee_outputs.append("[f=nut]pipe:1")
+    encode_cmd += [
+        "-filter_complex",
+        ";".join(filters),
+        *stream_args,
+        "-map",
+        "[reference]",
+        f"-c:{count}",
+        "rawvideo",
+        "-flags",
+        "+global_header",  # Required by the mp4 outputs behind the tee muxer
+        "-f",
+        "tee",
+        "|".join(tee_outputs),
+    ]
+
+    with tempfile.TemporaryDirectory(prefix="encodex_vmaf_") as log_dir:
+        log_paths = [os.path.join(log_dir, f"vmaf_{i:03d}.json") for i in range(count)]
+
+        # Compare every rung, brought to the metric resolution, with its own copy of the reference
+        metric_filters = [f"[0:{count}]split={count}" + "".join(f"[reference{i}]" for i in range(count))]
+        for i, (params, log_path) in enumerate(zip(params_list, log_paths)):
+            metric_filters.append(build_scale_filter(f"0:{i}", f"distorted{i}", parse_resolution(params["resolution"])))
+            metric_filters.append(
+                VMAF_FILTER.format(
+                    distorted=f"distorted{i}",
+                    reference=f"reference{i}",
+                    threads=vmaf_threads,
+                    subsample=vmaf_subsample(),
+                    log_path=log_path,
+                )
+            )
+        measure_cmd = [
+            "ffmpeg",
+            "-progress",
+            "pipe:1",
+            "-nostats",
+            "-loglevel",
+            "error",
+            "-f",
+            "nut",
+            "-i",
+            "pipe:0",
+            "-filter_complex_threads",
+            str(max(1, threads // 2)),
+            "-filter_complex",
+            ";".join(metric_filters),
+            "-f",
+            "null",
+            "-",
+        ]
+
+        logger.info(f"Executing FFmpeg command: {' '.join(encode_cmd)}")
+        logger.info(f"Executing FFmpeg command: {' '.join(measure_cmd)}")
+        # Connect the processes directly, the streamed frames never pass through Python
+        read_fd, write_fd = os.pipe()
+        encode_process = None
+        try:
+            encode_process = await asyncio.create_subprocess_exec(
+                *encode_cmd, stdout=write_fd, stderr=asyncio.subprocess.PIPE, preexec_fn=_pin_to(cpus)
+            )
+            measure_process = await asyncio.create_subprocess_exec(
+                *measure_cmd,
+                stdin=read_fd,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE,
+                preexec_fn=_pin_to(cpus),
+            )
+        except OSError as e:
+            logger.warning(f"Could not start fused encoding and measurement for segment {segment_id}: {str(e)}")
+            # Don't leave the encoder running without the process that consumes its output
+            if encode_process is not None:
+                try:
+                    encode_process.kill()
+                except ProcessLookupError:
+                    pass  # Already exited
+                await encode_process.wait()
+            return None
+        finally:
+            # Only the child processes may hold the pipe, so either one sees it close if the other exits
+            os.close(read_fd)
+            os.close(write_fd)
+
+        _, encode_stderr, measure_stderr = await asyncio.gather(
+            _report_progress(measure_process.stdout, segment_duration, show_progress),
+            encode_process.stderr.read(),
+            measure_process.stderr.read(),
         )
+        await asyncio.gather(encode_process.wait(), measure_process.wait())
+
+        if encode_process.returncode != 0 or measure_process.returncode != 0:
+            errors = (encode_stderr + measure_stderr).decode(errors="replace").strip()
+            logger.warning(f"Fused encoding and measurement failed for segment {segment_id}: {errors}")
+            return None
+
+        vmaf_results = read_vmaf_logs(log_paths)
+
+    if not all(vmaf_results):
         return None
-    else:
-        logger.info(f"Successfully created test encoding: {output_path}")
 
-    # Return TestEncoding object
-    return TestEncoding(path=output_path, resolution=resolution, bitrate=bitrate, segment=segment_id)
+    logger.info(f"Successfully created and measured test encodings: {', '.join(output_paths)}")
+    return [
+        TestEncoding(
+            path=output_path,
+            resolution=params["resolution"],
+            bitrate=params["bitrate"],
+            segment=segment_id,
+            vmaf=vmaf_result["vmaf"],
+            psnr=vmaf_result["psnr"],
+        )
+        for output_path, params, vmaf_result in zip(output_paths, params_list, vmaf_results)
+    ]
 
 
-def generate_test_encodings(state: EnCodexState, use_gpu: bool = False) -> EnCodexState:
+def generate_test_encodings(  # noqa: PLR0913 Too many arguments
+    state: EnCodexState,
+    use_gpu: bool = False,
+    jobs: Optional[int] = None,
+    full_segments: bool = False,
+    fused_metrics: bool = False,
+) -> EnCodexState:
     """
     Generates test encodings for selected segments.
 
+    By default only a short probe from the middle of each segment is encoded, which is enough to
+    rank the resolution/bitrate pairs. The segment ID of the test encodings is the probed range,
+    so the quality metrics compare against the same part of the source.
+
     Args:
         state: Current workflow state
-        use_gpu: If True and on macOS, attempt to use the VideoToolbox hardware encoder.
-                 Defaults to False (uses libx264 CPU encoder).
+        use_gpu: If True, attempt to use a hardware encoder (VideoToolbox, NVENC, Quick Sync or VAAPI)
+                 of the FFmpeg build. Defaults to False (uses libx264 CPU encoder).
+        jobs: Number of encodes to run concurrently. Defaults to a value derived from the usable CPUs.
+        full_segments: Encode the complete segments instead of a probe from their middle.
+        fused_metrics: Measure VMAF and PSNR while encoding, so the quality metrics node does not need to
+                       decode the source and the test encodings again. Always uses libx264.
 
     Returns:
         Updated workflow state with test encodings
@@ -222,6 +624,9 @@ def generate_test_encodings(state: EnCodexState, use_gpu: bool = False) -> EnCod
     output_dir = os.path.join(os.path.dirname(state.input_file), "test_encodings")
     logger.info(f"Output directory for test encodings: {output_dir}")
 
+    # Create output directory if it doesn't exist
+    os.makedirs(output_dir, exist_ok=True)
+
     # Initialize test encodings list
     state.test_encodings = []
 
@@ -254,7 +659,10 @@ def generate_test_encodings(state: EnCodexState, use_gpu: bool = False) -> EnCod
         ],
     }
 
-    # Process each selected segment
+    # Collect the encoding parameters for each selected segment. Jobs are keyed by the encoded range and
+    # their rungs by (resolution, bitrate), so a range selected twice (or a rung shared by the complexity
+    # tiers of overlapping selections) is encoded only once, as both would write the same file.
+    segment_jobs: Dict[str, Tuple[dict, Dict[Tuple[str, int], dict]]] = {}
     for segment in state.selected_segments:
         # Extract the segment data we need
         segment_data = {
@@ -265,6 +673,13 @@ def generate_test_encodings(state: EnCodexState, use_gpu: bool = False) -> EnCod
         segment_id = f"{segment.start_time:.2f}-{segment.end_time:.2f}"
         logger.info(f"Processing segment {segment_id} with complexity: {segment.complexity}")
 
+        if not full_segments:
+            segment_data["start_time"], segment_data["end_time"] = _probe_range(segment.start_time, segment.end_time)
+            logger.info(
+                f"Encoding probe {segment_data['start_time']:.2f}-{segment_data['end_time']:.2f} "
+                f"of segment {segment_id}"
+            )
+
         # Get encoding parameters based on segment complexity
         # Default to Medium if complexity is not recognized
         complexity = segment.complexity
@@ -277,21 +692,83 @@ def generate_test_encodings(state: EnCodexState, use_gpu: bool = False) -> EnCod
         params_to_use = encoding_params[complexity]
         logger.debug(f"Using parameters for '{complexity}' complexity: {params_to_use}")
 
-        # Generate test encodings for this segment
-        for params in encoding_params[complexity]:
-            encoding = _create_test_encoding(
-                input_file=state.input_file,
-                segment=segment_data,
-                resolution=params["resolution"],
-                bitrate=params["bitrate"],
-                output_dir=output_dir,
-                use_gpu=use_gpu,  # Pass the flag down
-            )
+        encoded_id = f"{segment_data['start_time']:.2f}-{segment_data['end_time']:.2f}"
+        _, rungs = segment_jobs.setdefault(encoded_id, (segment_data, {}))
+        for params in params_to_use:
+            rungs.setdefault((params["resolution"], params["bitrate"]), params)
+
+    encode_jobs = [(segment_data, list(rungs.values())) for segment_data, rungs in segment_jobs.values()]
 
+    # Every segment is encoded by an independent FFmpeg process, so run them concurrently
+    if not jobs or jobs < 1:
+        jobs = max(1, available_cpus() // _DEFAULT_THREADS_PER_ENCODE)
+    workers = max(1, min(jobs, len(encode_jobs)))
+    threads_per_job = max(1, available_cpus() // workers)
+    logger.info(
+        f"Encoding {len(encode_jobs)} segments with {workers} concurrent jobs ({threads_per_job} threads each)."
+    )
+
+    # Resolution of the original video, used to skip rescaling the reference if it is already at the metric resolution
+    reference_resolution = None
+    if state.video_metadata and state.video_metadata.width and state.video_metadata.height:
+        reference_resolution = (state.video_metadata.width, state.video_metadata.height)
+    if fused_metrics and use_gpu:
+        logger.warning("Measuring quality while encoding uses libx264, the GPU request is ignored for these encodes.")
+
+    async def encode_all() -> List[List[Optional[TestEncoding]]]:
+        # Supervise all FFmpeg processes from a single event loop, at most `workers` at a time.
+        # A job takes a CPU set from the queue and runs on those CPUs only, so concurrent jobs don't share cores.
+        cpu_sets: asyncio.Queue = asyncio.Queue()
+        for cpus in _cpu_sets(workers):
+            cpu_sets.put_nowait(cpus)
+        completed = 0
+
+        async def encode(segment_data: dict, params_to_use: List[dict]) -> List[Optional[TestEncoding]]:
+            nonlocal completed
+            cpus = await cpu_sets.get()
+            try:
+                if fused_metrics:
+                    encodings = await _create_measured_test_encodings(
+                        input_file=state.input_file,
+                        segment=segment_data,
+                        params_list=params_to_use,
+                        output_dir=output_dir,
+                        reference_resolution=reference_resolution,
+                        show_progress=workers == 1,
+                        threads=threads_per_job,
+                        cpus=cpus,
+                    )
+                    if encodings is not None:
+                        return encodings
+                    logger.warning("Falling back to encoding only, the quality metrics node will measure these.")
+
+                return await _create_test_encodings(
+                    input_file=state.input_file,
+                    segment=segment_data,
+                    params_list=params_to_use,
+                    output_dir=output_dir,
+                    use_gpu=use_gpu,  # Pass the flag down
+                    show_progress=workers == 1,
+                    threads=threads_per_job,
+                    cpus=cpus,
+                )
+            finally:
+                cpu_sets.put_nowait(cpus)
+                # Concurrent jobs don't print their own progress, report the overall progress once per segment
+                completed += 1
+                if workers > 1:
+                    logger.info(f"Finished {completed}/{len(encode_jobs)} segments.")
+
+        # gather keeps the results in job order, so the test encodings stay ordered by segment
+        return await asyncio.gather(*(encode(*job) for job in encode_jobs))
+
+    for (segment_data, params_to_use), encodings in zip(encode_jobs, asyncio.run(encode_all())):
+        for params, encoding in zip(params_to_use, encodings):
             if encoding:
                 state.test_encodings.append(encoding)
             else:
-                # Error already logged in _create_test_encoding
+                # Error already logged in _create_test_encodings
+                segment_id = f"{segment_data['start_time']:.2f}-{segment_data['end_time']:.2f}"
                 logger.warning(
                     f"Skipping failed encoding for segment {segment_id} ({params['resolution']} {params['bitrate']}k)"
                 )
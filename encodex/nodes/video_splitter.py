@@ -2,13 +2,100 @@
 Video splitter node for splitting videos into smaller chunks for processing by Gemini.
 """
 
-import json
 import os
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
 
+from encodex.ffmpeg_utils import available_cpus, snap_to_keyframes
 from encodex.graph_state import EnCodexState
 
 
+def _parse_probe_output(output: str) -> Tuple[float, List[float]]:
+    """
+    Parse the duration and keyframe timestamps from the CSV output of ffprobe.
+
+    Args:
+        output: ffprobe output with "packet,PTS_TIME,FLAGS" lines followed by a "format,DURATION" line
+
+    Returns:
+        Tuple of (duration in seconds or 0 if unknown, sorted keyframe timestamps in seconds)
+    """
+    duration = 0.0
+    keyframes = []
+    for line in output.splitlines():
+        section, _, values = line.partition(",")
+        try:
+            if section == "packet":
+                pts_time, _, flags = values.partition(",")
+                if "K" in flags:
+                    keyframes.append(float(pts_time))
+            elif section == "format":
+                duration = float(values)
+        except ValueError:
+            continue  # Packets without a timestamp or files without a duration report "N/A"
+    return duration, sorted(keyframes)
+
+
+def _create_chunk(low_res_path: str, output_path: str, start_time: float, chunk_duration: float) -> Optional[str]:
+    """
+    Cut one chunk out of the low-resolution video without re-encoding.
+
+    Args:
+        low_res_path: Path to the low-resolution video
+        output_path: Path of the chunk to create
+        start_time: Start of the chunk in seconds
+        chunk_duration: Duration of the chunk in seconds
+
+    Returns:
+        Error message if the chunk could not be created, None otherwise
+    """
+    cmd = [
+        "ffmpeg",
+        "-y",  # Overwrite existing files
+        # Seeking before the input jumps through the container index instead of reading up to the start
+        "-ss",
+        str(start_time),  # Start time
+        "-i",
+        low_res_path,
+        "-t",
+        str(chunk_duration),  # Duration
+        "-c",
+        "copy",  # Copy codecs (fast)
+        "-avoid_negative_ts",
+        "make_zero",  # Let every chunk start at timestamp zero
+        output_path,
+    ]
+    result = subprocess.run(cmd, capture_output=True, text=True)
+
+    if result.returncode != 0:
+        return result.stderr
+
+    # Verify file was created and is not empty
+    if not os.path.exists(output_path) or os.path.getsize(output_path) == 0:
+        return "chunk was not created or is empty"
+
+    return None
+
+
+def _remove_unused_chunks(chunk_paths: List[str], used_paths: List[str]) -> None:
+    """
+    Delete chunk files that were written by the low-res encoder but are not used.
+
+    The low-res encoder writes chunks whenever the preview may exceed the size limit, based on a
+    worst-case estimate, so the preview often turns out small enough to be used as a whole.
+
+    Args:
+        chunk_paths: Chunks written by the low-res encoder
+        used_paths: Paths that are used as chunks and must be kept
+    """
+    for path in set(chunk_paths) - set(used_paths):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print(f"Warning: Could not remove unused chunk {path}: {e}")
+
+
 def split_video(state: EnCodexState) -> EnCodexState:
     """
     Split a video into smaller chunks for Gemini processing.
@@ -17,7 +104,7 @@ def split_video(state: EnCodexState) -> EnCodexState:
         state: Current graph state with low_res_path
 
     Returns:
-        Updated state with chunk_paths added
+        Updated state with chunk_paths and the start time of every chunk in chunk_start_times
     """
     # Validate input
     if not state.low_res_path or not os.path.exists(state.low_res_path):
@@ -37,19 +124,38 @@ def split_video(state: EnCodexState) -> EnCodexState:
 
         # If file is already small enough, return it as is
         if file_size_mb <= max_size_mb:
-            # Just store the path as is
+            # Just store the path as is, no need to probe it
+            _remove_unused_chunks(state.chunk_paths, [low_res_path])
             state.chunk_paths = [low_res_path]
+            state.chunk_start_times = {low_res_path: 0.0}
             return state
 
-        # Get video duration
-        cmd = ["ffprobe", "-v", "quiet", "-print_format", "json", "-show_format", low_res_path]
+        # Reuse the chunks written by the low-res encoder in the same pass, if they all fit
+        if state.chunk_paths and all(
+            os.path.exists(path) and os.path.getsize(path) / (1024 * 1024) <= max_size_mb for path in state.chunk_paths
+        ):
+            print(f"Using {len(state.chunk_paths)} chunks created by the low-res encoder")
+            return state
+
+        # Get video duration and the keyframes of the video stream in a single ffprobe run
+        cmd = [
+            "ffprobe",
+            "-v",
+            "quiet",
+            "-select_streams",
+            "v:0",
+            "-show_entries",
+            "packet=pts_time,flags:format=duration",
+            "-of",
+            "csv",
+            low_res_path,
+        ]
         result = subprocess.run(cmd, capture_output=True, text=True)
         if result.returncode != 0:
             state.error = f"FFprobe error: {result.stderr}"
             return state
 
-        metadata = json.loads(result.stdout)
-        duration = float(metadata.get("format", {}).get("duration", 0))
+        duration, keyframes = _parse_probe_output(result.stdout)
 
         if duration <= 0:
             state.error = "Could not determine video duration"
@@ -67,49 +173,51 @@ def split_video(state: EnCodexState) -> EnCodexState:
         filename = os.path.basename(low_res_path)
         name, ext = os.path.splitext(filename)
 
-        # Create chunks
+        # Create chunks, replacing the ones written by the low-res encoder
+        encoder_chunks = list(state.chunk_paths)
         chunks = []
         # Initialize the dictionary in the state
         state.chunk_start_times = {}  # Ensure it's empty before starting
 
-        for i in range(num_chunks):
-            start_time = i * chunk_duration  # This is the offset we need
-            output_path = os.path.join(base_path, f"{name}_{i + 1:03d}{ext}")
-
-            cmd = [
-                "ffmpeg",
-                "-y",  # Overwrite existing files
-                "-i",
-                low_res_path,
-                "-ss",
-                str(start_time),  # Start time
-                "-t",
-                str(chunk_duration),  # Duration
-                "-c",
-                "copy",  # Copy codecs (fast)
-                output_path,
-            ]
+        start_times = [i * chunk_duration for i in range(num_chunks)]  # These are the offsets we need
+
+        # Align the chunk boundaries with keyframes, so every chunk starts exactly where the stream copy starts
+        if keyframes:
+            start_times = snap_to_keyframes(start_times, keyframes)
+            num_chunks = len(start_times)
+        chunk_durations = [end - start for start, end in zip(start_times, start_times[1:] + [duration])]
 
+        output_paths = [os.path.join(base_path, f"{name}_{i + 1:03d}{ext}") for i in range(num_chunks)]
+        for i, (output_path, start_time) in enumerate(zip(output_paths, start_times)):
             print(f"Creating chunk {i + 1}/{num_chunks}: {output_path} (starts at {start_time:.2f}s)")  # Log start time
-            result = subprocess.run(cmd, capture_output=True, text=True)
 
-            if result.returncode != 0:
-                print(f"Warning: Error creating chunk {i + 1}: {result.stderr}")
+        # Stream copying is mostly I/O, so cut all chunks concurrently
+        with ThreadPoolExecutor(max_workers=min(num_chunks, available_cpus())) as executor:
+            errors = list(
+                executor.map(
+                    _create_chunk,
+                    [low_res_path] * num_chunks,
+                    output_paths,
+                    start_times,
+                    chunk_durations,
+                )
+            )
+
+        for i, (output_path, start_time, error) in enumerate(zip(output_paths, start_times, errors)):
+            if error:
+                print(f"Warning: Error creating chunk {i + 1}: {error}")
                 continue
 
-            # Verify file was created and is not empty
-            if os.path.exists(output_path) and os.path.getsize(output_path) > 0:
-                chunks.append(output_path)
-                # Store the start time for this chunk
-                state.chunk_start_times[output_path] = start_time
-            else:
-                print(f"Warning: Chunk {i + 1} was not created or is empty")
+            chunks.append(output_path)
+            # Store the start time for this chunk
+            state.chunk_start_times[output_path] = start_time
 
         if not chunks:
             state.error = "Failed to create any valid chunks"
             return state
 
         # Update state with chunk paths
+        _remove_unused_chunks(encoder_chunks, chunks)
         state.chunk_paths = chunks
 
         return state
@@ -0,0 +1,191 @@
+"""
+Helpers for measuring quality with FFmpeg's libvmaf filter, shared by the test encoding and quality metrics nodes.
+"""
+
+import json
+import logging
+import math
+import os
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# libvmaf computes features on every n-th frame only. Every frame is scored by default, so the scores
+# stay comparable with earlier runs. Subsampling (e.g. ENCODEX_VMAF_SUBSAMPLE=3) is opt-in: it speeds up
+# the measurement and still ranks the test encodings, but PSNR is then pooled over the sampled frames only.
+DEFAULT_VMAF_SUBSAMPLE = 1
+VMAF_SUBSAMPLE_ENV = "ENCODEX_VMAF_SUBSAMPLE"
+
+# Resolution at which encodings are compared against the source (matches the default 1080p VMAF model)
+METRIC_RESOLUTION = (1920, 1080)
+
+# Squared peak value of 8-bit video, and the PSNR libvmaf reports for identical frames
+PSNR_PEAK = 255.0**2
+PSNR_MAX_DB = 60.0
+
+# VMAF model used for all measurements, set explicitly so cached scores can be tied to it
+VMAF_MODEL = "vmaf_v0.6.1"
+
+# Filter templates for the metric filters. libvmaf also extracts the PSNR feature, so a single pass
+# yields both metrics; libvmaf_cuda works on frames in GPU memory, so both streams are uploaded first.
+VMAF_OPTIONS = (
+    f"model=version={VMAF_MODEL}:"
+    + "n_threads={threads}:n_subsample={subsample}:feature=name=psnr:log_fmt=json:log_path={log_path}"
+)
+VMAF_FILTER = "[{distorted}][{reference}]libvmaf=" + VMAF_OPTIONS
+VMAF_CUDA_FILTER = (
+    "[{distorted}]format=yuv420p,hwupload_cuda[{distorted}_cuda];"
+    "[{reference}]format=yuv420p,hwupload_cuda[{reference}_cuda];"
+    "[{distorted}_cuda][{reference}_cuda]libvmaf_cuda=" + VMAF_OPTIONS
+)
+
+
+def vmaf_subsample() -> int:
+    """
+    Determine the frame subsampling of the VMAF calculation.
+
+    Returns:
+        Compute the metrics on every n-th frame, from ENCODEX_VMAF_SUBSAMPLE or the default
+    """
+    return positive_int_from_env(VMAF_SUBSAMPLE_ENV) or DEFAULT_VMAF_SUBSAMPLE
+
+
+def positive_int_from_env(name: str) -> Optional[int]:
+    """
+    Read a positive integer setting from the environment.
+
+    Args:
+        name: Name of the environment variable
+
+    Returns:
+        The value if the variable is set to a positive integer, None otherwise
+    """
+    value = os.environ.get(name)
+    if not value:
+        return None
+
+    try:
+        number = int(value)
+    except ValueError:
+        number = 0
+    if number < 1:
+        logger.warning(f"Ignoring invalid {name} value: {value}")
+        return None
+    return number
+
+
+def parse_resolution(resolution: Optional[str]) -> Optional[Tuple[int, int]]:
+    """
+    Parse a resolution string into integers.
+
+    Args:
+        resolution: Resolution in the format "WIDTHxHEIGHT"
+
+    Returns:
+        Tuple of (width, height), or None if the resolution is unknown or malformed
+    """
+    try:
+        width, height = map(int, resolution.split("x"))
+        return width, height
+    except (AttributeError, ValueError):
+        return None
+
+
+def build_scale_filter(pad: str, label: str, resolution: Optional[Tuple[int, int]]) -> str:
+    """
+    Build a filter that brings a stream to the metric resolution.
+
+    Streams that are already at the metric resolution are passed through with a no-op filter
+    instead of being rescaled. Unknown resolutions are always scaled.
+
+    Lower resolutions are upscaled rather than the reference being downscaled to match them:
+    VMAF is defined at the viewing resolution, and scoring every rung at the same resolution
+    is what makes the scores of different resolutions comparable for the convex hull.
+
+    Args:
+        pad: Input pad of the filter (e.g. "0:v")
+        label: Output label of the filter
+        resolution: Resolution of the stream, if known
+
+    Returns:
+        Filter graph fragment producing the given label
+    """
+    if resolution == METRIC_RESOLUTION:
+        return f"[{pad}]null[{label}]"
+    width, height = METRIC_RESOLUTION
+    return f"[{pad}]scale={width}:{height}:flags=bicubic[{label}]"
+
+
+def pooled_psnr(vmaf_data: Dict) -> Optional[float]:
+    """
+    Compute the overall PSNR from the per-frame PSNR values in a libvmaf JSON log.
+
+    Matches FFmpeg's psnr filter: the per-plane MSE is weighted by plane size (4:2:0),
+    averaged over all frames and converted back to PSNR.
+
+    Args:
+        vmaf_data: Parsed libvmaf JSON log
+
+    Returns:
+        Average PSNR in dB, or None if the log has no PSNR values
+    """
+    total_mse = 0.0
+    frames = vmaf_data.get("frames", [])
+    try:
+        for frame in frames:
+            metrics = frame["metrics"]
+            mse_y, mse_cb, mse_cr = (PSNR_PEAK / 10 ** (metrics[key] / 10) for key in ("psnr_y", "psnr_cb", "psnr_cr"))
+            total_mse += (4 * mse_y + mse_cb + mse_cr) / 6
+    except (KeyError, TypeError):
+        # Fall back to the pooled luma PSNR if the per-frame values are incomplete
+        return vmaf_data.get("pooled_metrics", {}).get("psnr_y", {}).get("mean")
+
+    if not frames:
+        return None
+    if total_mse == 0:
+        return PSNR_MAX_DB
+    return min(PSNR_MAX_DB, 10 * math.log10(PSNR_PEAK / (total_mse / len(frames))))
+
+
+def parse_vmaf_log(vmaf_data: Dict) -> Optional[Dict]:
+    """
+    Extract the scores from a parsed libvmaf JSON log.
+
+    Args:
+        vmaf_data: Parsed libvmaf JSON log
+
+    Returns:
+        Dictionary with the VMAF score and PSNR (None if unavailable), or None if the log has no VMAF score
+    """
+    # Extract VMAF score
+    vmaf_score = None
+    if "pooled_metrics" in vmaf_data and "vmaf" in vmaf_data["pooled_metrics"]:
+        vmaf_score = vmaf_data["pooled_metrics"]["vmaf"].get("mean", None)
+
+    # Return VMAF score, with the PSNR computed in the same pass
+    if vmaf_score is not None:
+        return {"vmaf": vmaf_score, "psnr": pooled_psnr(vmaf_data)}
+    else:
+        logger.warning("Could not find VMAF score in output")
+        return None
+
+
+def read_vmaf_logs(log_paths: List[str]) -> List[Optional[Dict]]:
+    """
+    Read the scores from libvmaf JSON log files.
+
+    Args:
+        log_paths: Paths of the log files
+
+    Returns:
+        Result of parse_vmaf_log per log file, None for files that cannot be read
+    """
+    results = []
+    for log_path in log_paths:
+        try:
+            with open(log_path, "r") as f:
+                results.append(parse_vmaf_log(json.load(f)))
+        except (OSError, ValueError) as e:
+            logger.error(f"Error reading VMAF log {log_path}: {str(e)}")
+            results.append(None)
+    return results
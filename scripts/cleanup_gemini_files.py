@@ -9,20 +9,51 @@ Requires the `google-generativeai` library and the `GEMINI_API_KEY`
 environment variable to be set.
 
 Usage:
-  python scripts/cleanup_gemini_files.py <path_to_state.json>
+  python scripts/cleanup_gemini_files.py <path_to_state.json> [--concurrency 8] [--qps 5]
 """
 
 import argparse
 import json
+import logging
 import os
 import re
 import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 from google import genai
 
 # Regex to extract the file ID from the URI (e.g., files/xxxx -> xxxx)
 # Handles both full URLs and just the 'files/...' part
-GEMINI_FILE_ID_PATTERN = r"(?:files\/|v1beta\/files\/)([a-zA-Z0-9_-]+)$"
+GEMINI_FILE_ID_RE = re.compile(r"(?:files\/|v1beta\/files\/)([a-zA-Z0-9_-]+)$")
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimiter:
+    """Spaces out calls from several threads so that at most `qps` calls start per second."""
+
+    def __init__(self, qps: Optional[float]):
+        """
+        Args:
+            qps: Maximum calls per second, None or 0 for no limit.
+        """
+        self.interval = 1.0 / qps if qps else 0.0
+        self.next_call = 0.0
+        self.lock = threading.Lock()
+
+    def wait(self) -> None:
+        """Block until the next call may start."""
+        if not self.interval:
+            return
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_call - now
+            self.next_call = max(now, self.next_call) + self.interval
+        if delay > 0:
+            time.sleep(delay)
 
 
 def delete_gemini_file(client: genai.Client, file_id: str) -> bool:
@@ -41,18 +72,17 @@ def delete_gemini_file(client: genai.Client, file_id: str) -> bool:
         # Check if file exists first (optional, delete is idempotent)
         # client.files.get(name=file_name)
 
-        print(f"Attempting to delete file: {file_name} ... ", end="")
         client.files.delete(name=file_name)
-        print("Success.")
+        logger.info("Deleted file: %s", file_name)
         return True
     except Exception as e:
         # Handle cases where the file might already be deleted or other errors
         error_message = str(e)
         if "not found" in error_message.lower():
-            print(f"File {file_name} not found (already deleted?). Skipping.")
+            logger.warning("File %s not found (already deleted?). Skipping.", file_name)
             return True  # Consider 'not found' as success in cleanup
         else:
-            print(f"Failed. Error: {error_message}")
+            logger.error("Failed to delete file %s. Error: %s", file_name, error_message)
             return False
 
 
@@ -63,8 +93,25 @@ def main():
         "state_file",
         help="Path to the EncodEx JSON state file containing the chunk_uri_map.",
     )
+    parser.add_argument(
+        "--concurrency",
+        type=int,
+        default=8,
+        help="Number of deletions in flight at the same time (default: 8).",
+    )
+    parser.add_argument(
+        "--qps",
+        type=float,
+        default=None,
+        help="Maximum deletion requests per second, to stay within the API quota (default: no limit).",
+    )
     args = parser.parse_args()
 
+    # Deletions run concurrently and report through logging, which writes every message as a whole line.
+    # Only this script logs at INFO level, the HTTP client libraries keep the default WARNING level.
+    logging.basicConfig(format="%(message)s", stream=sys.stdout)
+    logger.setLevel(logging.INFO)
+
     # Check for API key
     api_key = os.environ.get("GEMINI_API_KEY")
     if not api_key:
@@ -96,35 +143,53 @@ def main():
         print("Error: 'chunk_uri_map' is not a valid dictionary.")
         sys.exit(1)
 
-    # Initialize Gemini client
-    try:
-        client = genai.Client(api_key=api_key)
-    except Exception as e:
-        print(f"Error initializing Gemini client: {e}")
-        sys.exit(1)
-
     print(f"Found {len(chunk_uri_map)} file URIs in {args.state_file}.")
 
     success_count = 0
     fail_count = 0
 
-    # Iterate and delete
+    # Collect the file IDs to delete, a file uploaded once may be listed for several chunks.
+    # The dict keeps every ID once, in the order of the state file.
+    file_ids = {}
+    uri_count = 0
     for local_path, uri in chunk_uri_map.items():
         if not isinstance(uri, str):
             print(f"Warning: Skipping invalid URI entry for {local_path}: {uri}")
             continue
 
-        match = re.search(GEMINI_FILE_ID_PATTERN, uri)
+        match = GEMINI_FILE_ID_RE.search(uri)
         if match:
-            file_id = match.group(1)
-            if delete_gemini_file(client, file_id):
-                success_count += 1
-            else:
-                fail_count += 1
+            uri_count += 1
+            file_ids[match.group(1)] = None
         else:
             print(f"Warning: Could not extract file ID from URI: {uri}")
             fail_count += 1
 
+    if uri_count > len(file_ids):
+        print(f"Skipping {uri_count - len(file_ids)} duplicate file URIs.")
+
+    if file_ids:
+        # Initialize Gemini client, only when there is something to delete
+        try:
+            client = genai.Client(api_key=api_key)
+        except Exception as e:
+            print(f"Error initializing Gemini client: {e}")
+            sys.exit(1)
+
+        # Deleting is bound by the API round trip, so keep several requests in flight
+        rate_limiter = RateLimiter(args.qps)
+
+        def delete(file_id: str) -> bool:
+            rate_limiter.wait()
+            return delete_gemini_file(client, file_id)
+
+        with ThreadPoolExecutor(max_workers=max(1, args.concurrency)) as executor:
+            results = list(executor.map(delete, file_ids))
+        success_count += sum(results)
+        fail_count += len(results) - sum(results)
+    else:
+        print("No valid file IDs found. Nothing to delete.")
+
     print("\nCleanup Summary:")
     print(f"  Successfully deleted (or file not found): {success_count}")
     print(f"  Failed to delete (or invalid URI): {fail_count}")
@@ -3,50 +3,100 @@ Test script to demonstrate convex hull optimization for encoding ladder generati
 """
 
 import json
+import re
+from functools import lru_cache
 
 import matplotlib.pyplot as plt
 import numpy as np
 
+# Resolution and bitrate at the end of an encoding ID, e.g. "..._1280x720_4500k.mp4"
+_ENCODING_ID_RE = re.compile(r"_(?P<resolution>(?P<width>\d+)x(?P<height>\d+))_(?P<bitrate>\d+)k\.")
+
+# Colors and markers of the resolutions in the plot
+_COLORS = plt.cm.tab10(np.linspace(0, 1, 10))
+_MARKERS = ("o", "s", "^", "D", "p", "*", "x", "+")
+
 
 # Simulating the convex hull computation
-def parse_encoding_id(encoding_id: str):
-    """Parse encoding ID to extract resolution and bitrate."""
-    parts = encoding_id.split("_")
-    resolution = parts[-2]  # e.g., "1280x720"
-    bitrate_part = parts[-1]  # e.g., "4500k.mp4"
-    bitrate = int(bitrate_part.split("k.")[0])
-    return resolution, bitrate
+@lru_cache(maxsize=4096)
+def parse_encoding_id(encoding_id: str) -> tuple[str, int, int, int]:
+    """Parse encoding ID to extract resolution, bitrate, width and height."""
+    match = _ENCODING_ID_RE.search(encoding_id)
+    if not match:
+        raise ValueError(f"Unexpected encoding ID: {encoding_id}")
+    return match.group("resolution"), int(match.group("bitrate")), int(match.group("width")), int(match.group("height"))
+
+
+def h264_profile(width: int) -> str:
+    """H.264 profile for a ladder rung of the given width."""
+    return "high" if width >= 1280 else "main" if width >= 640 else "baseline"
+
+
+def _cross(a, b, c):
+    """Cross product of a->b and a->c in the bitrate/VMAF plane, positive if b lies below the line a->c."""
+    return (b["bitrate"] - a["bitrate"]) * (c["vmaf"] - a["vmaf"]) - (b["vmaf"] - a["vmaf"]) * (
+        c["bitrate"] - a["bitrate"]
+    )
 
 
 def compute_convex_hull(quality_metrics):
-    """Compute the convex hull (Pareto frontier) of quality-bitrate points."""
+    """
+    Compute the convex hull (Pareto frontier) of quality-bitrate points.
+
+    Returns the hull points sorted by bitrate (ascending) and all parsed points.
+    """
     # Parse encoding_id to extract resolution and bitrate
     parsed_metrics = []
     for metric in quality_metrics:
-        resolution, bitrate = parse_encoding_id(metric["encoding_id"])
+        resolution, bitrate, width, height = parse_encoding_id(metric["encoding_id"])
         parsed_metrics.append(
-            {"encoding_id": metric["encoding_id"], "resolution": resolution, "bitrate": bitrate, "vmaf": metric["vmaf"]}
+            {
+                "encoding_id": metric["encoding_id"],
+                "resolution": resolution,
+                "bitrate": bitrate,
+                "vmaf": metric["vmaf"],
+                "width": width,
+                "height": height,
+            }
         )
 
-    # Sort by bitrate
-    sorted_metrics = sorted(parsed_metrics, key=lambda x: x["bitrate"])
+    if not parsed_metrics:
+        return [], parsed_metrics
 
-    # Compute convex hull (upper envelope)
-    hull_points = []
-    max_vmaf_so_far = -float("inf")
+    # Sort by bitrate, keeping the input order for equal bitrates
+    bitrates = np.fromiter((p["bitrate"] for p in parsed_metrics), dtype=np.int64, count=len(parsed_metrics))
+    vmafs = np.fromiter((p["vmaf"] for p in parsed_metrics), dtype=np.float64, count=len(parsed_metrics))
+    order = np.argsort(bitrates, kind="stable")
+    sorted_vmafs = vmafs[order]
 
-    for point in sorted_metrics:
-        if point["vmaf"] > max_vmaf_so_far:
-            hull_points.append(point)
-            max_vmaf_so_far = point["vmaf"]
+    # Upper envelope: keep the points that beat the best VMAF at any lower bitrate
+    max_vmaf_before = np.concatenate(([-np.inf], np.maximum.accumulate(sorted_vmafs)[:-1]))
+    envelope_indices = order[sorted_vmafs > max_vmaf_before]
 
-    return hull_points
+    # Upper convex hull of the envelope (monotone chain): drop the points on or below
+    # the line between their neighbours, they have a worse quality gain per kbps
+    hull_points = []
+    for index in envelope_indices:
+        point = parsed_metrics[index]
+        # A point at the same bitrate with a higher VMAF replaces the previous one
+        while hull_points and hull_points[-1]["bitrate"] == point["bitrate"]:
+            hull_points.pop()
+        while len(hull_points) >= 2 and _cross(hull_points[-2], hull_points[-1], point) >= 0:
+            hull_points.pop()
+        hull_points.append(point)
+
+    # Pick the profile of the hull points here, so printing the ladder needs no parsing
+    for point in hull_points:
+        point["profile"] = h264_profile(point["width"])
+    return hull_points, parsed_metrics
 
 
 def refine_ladder_points(hull_points):
-    """Refine ladder points to ensure reasonable spacing."""
-    # Ensure hull points are sorted by bitrate (ascending)
-    sorted_hull = sorted(hull_points, key=lambda x: x["bitrate"])
+    """Refine hull points, sorted by bitrate as returned by compute_convex_hull, to ensure reasonable spacing."""
+    # The hull is already sorted by bitrate, so it is only checked instead of sorted again
+    if any(a["bitrate"] > b["bitrate"] for a, b in zip(hull_points, hull_points[1:])):
+        raise ValueError("Hull points must be sorted by bitrate (ascending)")
+    sorted_hull = hull_points
 
     # If we have very few points, return them all
     if len(sorted_hull) <= 4:
@@ -68,43 +118,76 @@ def refine_ladder_points(hull_points):
             last_added = point
 
     # Always include the highest bitrate point if not already added
-    if sorted_hull[-1] != last_added:
+    if sorted_hull[-1] is not last_added:
         refined_points.append(sorted_hull[-1])
 
     return refined_points
 
 
+def build_ladder(quality_metrics):
+    """
+    Compute the convex hull and the ladder rungs on it, sorting the points only once.
+
+    Returns the hull points, the ladder rungs and all parsed points.
+    """
+    hull_points, all_points = compute_convex_hull(quality_metrics)
+    return hull_points, refine_ladder_points(hull_points), all_points
+
+
+def to_soa(points):
+    """Convert a list of points to arrays of their resolutions, bitrates and VMAF scores."""
+    return {
+        "resolution": np.array([p["resolution"] for p in points]),
+        "bitrate": np.array([p["bitrate"] for p in points]),
+        "vmaf": np.array([p["vmaf"] for p in points]),
+    }
+
+
 def visualize_convex_hull(all_points, hull_points, refined_points=None):
     """Visualize all points and the convex hull."""
     plt.figure(figsize=(12, 8))
 
-    # Create lists for plotting
-    resolutions = sorted(list(set([p["resolution"] for p in all_points])))
-    colors = plt.cm.tab10(np.linspace(0, 1, len(resolutions)))
-    markers = ["o", "s", "^", "D", "p", "*", "x", "+"]
+    # Extract the fields of the points once for plotting
+    all_soa = to_soa(all_points)
+    hull_soa = to_soa(hull_points)
+
+    # The resolutions in order of appearance
+    resolutions = list(dict.fromkeys(all_soa["resolution"]))
 
     # Plot all points, with different colors and markers for each resolution
     for i, resolution in enumerate(resolutions):
-        resolution_points = [p for p in all_points if p["resolution"] == resolution]
-        x = [p["bitrate"] for p in resolution_points]
-        y = [p["vmaf"] for p in resolution_points]
-        plt.scatter(x, y, c=[colors[i]], marker=markers[i % len(markers)], label=f"{resolution}", s=100, alpha=0.7)
+        mask = all_soa["resolution"] == resolution
+        plt.scatter(
+            all_soa["bitrate"][mask],
+            all_soa["vmaf"][mask],
+            c=[_COLORS[i % len(_COLORS)]],
+            marker=_MARKERS[i % len(_MARKERS)],
+            label=f"{resolution}",
+            s=100,
+            alpha=0.7,
+        )
 
     # Plot convex hull line
-    hull_x = [p["bitrate"] for p in hull_points]
-    hull_y = [p["vmaf"] for p in hull_points]
-    plt.plot(hull_x, hull_y, "r-", linewidth=2, label="Convex Hull")
+    plt.plot(hull_soa["bitrate"], hull_soa["vmaf"], "r-", linewidth=2, label="Convex Hull")
 
     # Plot hull points
-    hull_scatter_x = [p["bitrate"] for p in hull_points]
-    hull_scatter_y = [p["vmaf"] for p in hull_points]
-    plt.scatter(hull_scatter_x, hull_scatter_y, c="red", s=150, marker="o", facecolors="none", linewidth=2, zorder=10)
+    plt.scatter(
+        hull_soa["bitrate"], hull_soa["vmaf"], c="red", s=150, marker="o", facecolors="none", linewidth=2, zorder=10
+    )
 
     # Plot refined points if provided
     if refined_points:
-        refined_x = [p["bitrate"] for p in refined_points]
-        refined_y = [p["vmaf"] for p in refined_points]
-        plt.scatter(refined_x, refined_y, c="green", s=200, marker="X", linewidth=2, zorder=11, label="Ladder Rungs")
+        refined_soa = to_soa(refined_points)
+        plt.scatter(
+            refined_soa["bitrate"],
+            refined_soa["vmaf"],
+            c="green",
+            s=200,
+            marker="X",
+            linewidth=2,
+            zorder=11,
+            label="Ladder Rungs",
+        )
 
     # Set plot properties
     plt.title("Video Encoding Quality vs. Bitrate with Convex Hull", fontsize=16)
@@ -114,8 +197,8 @@ def visualize_convex_hull(all_points, hull_points, refined_points=None):
     plt.legend(fontsize=12)
 
     # Set axis limits
-    plt.xlim(0, max([p["bitrate"] for p in all_points]) * 1.1)
-    plt.ylim(min([p["vmaf"] for p in all_points]) * 0.9, 100)
+    plt.xlim(0, all_soa["bitrate"].max() * 1.1)
+    plt.ylim(all_soa["vmaf"].min() * 0.9, 100)
 
     # Add annotations
     for point in hull_points:
@@ -144,17 +227,8 @@ def main():
     # Extract quality metrics
     quality_metrics = data["quality_metrics"]
 
-    # Compute convex hull
-    hull_points = compute_convex_hull(quality_metrics)
-
-    # Refine ladder points
-    refined_points = refine_ladder_points(hull_points)
-
-    # Parse all metrics for visualization
-    all_points = []
-    for metric in quality_metrics:
-        resolution, bitrate = parse_encoding_id(metric["encoding_id"])
-        all_points.append({"resolution": resolution, "bitrate": bitrate, "vmaf": metric["vmaf"]})
+    # Compute convex hull and refine it into ladder points, keeping all parsed points for visualization
+    hull_points, refined_points, all_points = build_ladder(quality_metrics)
 
     # Visualize results
     visualize_convex_hull(all_points, hull_points, refined_points)
@@ -174,9 +248,7 @@ def main():
     print(f"\nFinal Encoding Ladder (with {complexity} complexity adjustment {adjustment_factor:.2f}):")
     for point in refined_points:
         adjusted_bitrate = int(point["bitrate"] * adjustment_factor)
-        width, height = point["resolution"].split("x")
-        profile = "high" if int(width) >= 1280 else "main" if int(width) >= 640 else "baseline"
-        print(f"{point['resolution']} @ {adjusted_bitrate}k ({profile}) -> Expected VMAF {point['vmaf']:.2f}")
+        print(f"{point['resolution']} @ {adjusted_bitrate}k ({point['profile']}) -> Expected VMAF {point['vmaf']:.2f}")
 
     # Estimated savings (example calculation)
     estimated_savings = "10%" if complexity == "High" else "15%"
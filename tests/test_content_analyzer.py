@@ -0,0 +1,48 @@
+"""
+Tests for parsing the segment timestamps returned by Gemini.
+"""
+
+import pytest
+
+from encodex.nodes.content_analyzer import _parse_timestamp
+
+
+def _split_parse_timestamp(timestamp_str):
+    """The split-based parser that _parse_timestamp replaced, used as the reference."""
+    parts = timestamp_str.strip().split(":")
+    try:
+        if len(parts) == 3:
+            return int(parts[0]) * 3600 + int(parts[1]) * 60 + float(parts[2])
+        elif len(parts) == 2:
+            return int(parts[0]) * 60 + float(parts[1])
+        elif len(parts) == 1:
+            return float(parts[0])
+        else:
+            raise ValueError(f"Invalid timestamp format: {timestamp_str}")
+    except ValueError:
+        return 0.0
+
+
+@pytest.mark.parametrize(
+    "timestamp",
+    [
+        "00:01:05.250",
+        "01:02:03",
+        "1:05",
+        "12:00",
+        "00:00",
+        "65.5",
+        "0",
+        "5.",
+        ".5",
+        " 00:00:10 ",
+        "10:30.75",
+        "",
+        "abc",
+        "1:xx",
+        "1:2:3:4",
+    ],
+)
+def test_matches_split_parser(timestamp):
+    """The regex parser returns the same seconds as the split-based parser, including 0.0 for invalid input."""
+    assert _parse_timestamp(timestamp) == pytest.approx(_split_parse_timestamp(timestamp))
@@ -0,0 +1,99 @@
+"""
+Tests for the upper convex hull in scripts/convex_hull.py.
+"""
+
+import importlib.util
+from pathlib import Path
+
+import pytest
+
+_SCRIPT_PATH = Path(__file__).resolve().parents[1] / "scripts" / "convex_hull.py"
+_spec = importlib.util.spec_from_file_location("convex_hull", _SCRIPT_PATH)
+convex_hull = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(convex_hull)
+
+
+def _metric(resolution, bitrate, vmaf):
+    """Build a quality metric dict with an encoding ID in the test encoding file name format."""
+    return {"encoding_id": f"test_encoding_0.00-5.00_{resolution}_{bitrate}k.mp4", "vmaf": vmaf}
+
+
+def _hull(metrics):
+    """Compute the hull and return its (bitrate, vmaf) pairs."""
+    hull_points, _ = convex_hull.compute_convex_hull(metrics)
+    return [(point["bitrate"], point["vmaf"]) for point in hull_points]
+
+
+def test_cross_sign():
+    """The cross product is positive for a point below the line, negative above it and zero on it."""
+    a = {"bitrate": 0, "vmaf": 0.0}
+    c = {"bitrate": 2, "vmaf": 2.0}
+    assert convex_hull._cross(a, {"bitrate": 1, "vmaf": 0.5}, c) > 0
+    assert convex_hull._cross(a, {"bitrate": 1, "vmaf": 1.5}, c) < 0
+    assert convex_hull._cross(a, {"bitrate": 1, "vmaf": 1.0}, c) == 0
+
+
+def test_empty_input():
+    """No metrics give an empty hull."""
+    assert convex_hull.compute_convex_hull([]) == ([], [])
+
+
+def test_single_point():
+    """A single point is the whole hull."""
+    assert _hull([_metric("640x360", 500, 70.0)]) == [(500, 70.0)]
+
+
+def test_point_below_chord_is_dropped():
+    """A point under the line between its neighbours has a worse quality gain per kbps."""
+    metrics = [_metric("640x360", 300, 50.0), _metric("640x360", 500, 60.0), _metric("960x540", 800, 82.0)]
+    assert _hull(metrics) == [(300, 50.0), (800, 82.0)]
+
+
+def test_point_above_chord_is_kept():
+    """A point above the line between its neighbours stays on the hull."""
+    metrics = [_metric("640x360", 300, 50.0), _metric("640x360", 500, 75.0), _metric("960x540", 800, 82.0)]
+    assert _hull(metrics) == [(300, 50.0), (500, 75.0), (800, 82.0)]
+
+
+def test_collinear_points_are_dropped():
+    """A point exactly on the line between its neighbours adds nothing to the hull."""
+    metrics = [_metric("640x360", 1000, 60.0), _metric("960x540", 2000, 70.0), _metric("1280x720", 3000, 80.0)]
+    assert _hull(metrics) == [(1000, 60.0), (3000, 80.0)]
+
+
+def test_same_bitrate_keeps_the_best_vmaf():
+    """Of two points at the same bitrate only the one with the higher VMAF stays."""
+    metrics = [_metric("640x360", 800, 70.0), _metric("960x540", 800, 75.0), _metric("1280x720", 2000, 90.0)]
+    assert _hull(metrics) == [(800, 75.0), (2000, 90.0)]
+
+
+def test_points_without_quality_gain_are_dropped():
+    """Points at a higher bitrate that don't improve on the best VMAF so far are not on the hull."""
+    metrics = [_metric("1280x720", 2000, 90.0), _metric("1920x1080", 3000, 90.0), _metric("1920x1080", 4500, 88.0)]
+    assert _hull(metrics) == [(2000, 90.0)]
+
+
+def test_hull_is_sorted_and_concave():
+    """The hull is sorted by bitrate and its slope never increases."""
+    metrics = [
+        _metric(resolution, bitrate, vmaf)
+        for resolution, bitrate, vmaf in [
+            ("1920x1080", 6000, 97.0),
+            ("640x360", 300, 40.0),
+            ("1280x720", 2000, 90.0),
+            ("960x540", 800, 75.0),
+            ("640x360", 500, 55.0),
+            ("1280x720", 3000, 93.0),
+        ]
+    ]
+    hull = _hull(metrics)
+    assert hull == sorted(hull)
+    slopes = [(v2 - v1) / (b2 - b1) for (b1, v1), (b2, v2) in zip(hull, hull[1:])]
+    assert slopes == sorted(slopes, reverse=True)
+
+
+def test_refine_rejects_unsorted_points():
+    """Refining requires hull points sorted by bitrate."""
+    points = [{"bitrate": 2000, "resolution": "1280x720"}, {"bitrate": 500, "resolution": "640x360"}]
+    with pytest.raises(ValueError):
+        convex_hull.refine_ladder_points(points)
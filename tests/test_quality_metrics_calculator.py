@@ -0,0 +1,54 @@
+"""
+Tests for the PSNR prefilter of the quality metrics calculator.
+"""
+
+from encodex import graph_state
+from encodex.nodes.quality_metrics_calculator import _find_undominated
+
+
+def _encodings(*bitrates):
+    """Build test encodings of one segment with the given bitrates (kbps)."""
+    return [
+        graph_state.TestEncoding(path=f"enc_{i}.mp4", resolution="1280x720", bitrate=bitrate, segment="0.00-5.00")
+        for i, bitrate in enumerate(bitrates)
+    ]
+
+
+def test_single_encoding_is_kept():
+    """A single encoding has nothing to be dominated by."""
+    assert _find_undominated(_encodings(1000), [35.0]) == [True]
+
+
+def test_cheaper_encoding_with_higher_psnr_dominates():
+    """An encoding is dropped when a lower bitrate already reached a higher PSNR."""
+    assert _find_undominated(_encodings(2000, 1000), [34.0, 36.0]) == [False, True]
+
+
+def test_increasing_psnr_keeps_all():
+    """Encodings that improve on every cheaper encoding are all kept."""
+    assert _find_undominated(_encodings(500, 1000, 2000), [30.0, 33.0, 36.0]) == [True, True, True]
+
+
+def test_equal_psnr_is_not_dominated():
+    """A higher bitrate with the same PSNR is not dominated, only a strictly lower PSNR is."""
+    assert _find_undominated(_encodings(1000, 2000), [35.0, 35.0]) == [True, True]
+
+
+def test_equal_bitrate_with_lower_psnr_is_dominated():
+    """At equal bitrates, an encoding with a lower PSNR than the one before it is dropped."""
+    assert _find_undominated(_encodings(1000, 1000), [36.0, 34.0]) == [True, False]
+
+
+def test_equal_bitrate_with_higher_psnr_keeps_both():
+    """At equal bitrates, an encoding that improves on the one before it keeps both."""
+    assert _find_undominated(_encodings(1000, 1000), [34.0, 36.0]) == [True, True]
+
+
+def test_unknown_psnr_is_kept():
+    """Encodings without a PSNR are always measured and don't affect the others."""
+    assert _find_undominated(_encodings(500, 1000, 2000), [36.0, None, 34.0]) == [True, True, False]
+
+
+def test_no_encodings():
+    """An empty segment gives an empty result."""
+    assert _find_undominated([], []) == []
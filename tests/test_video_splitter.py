@@ -0,0 +1,34 @@
+"""
+Tests for parsing the ffprobe output of the video splitter.
+"""
+
+from encodex.nodes.video_splitter import _parse_probe_output
+
+
+def test_duration_and_keyframes():
+    """Keyframe packets are collected and the duration is read from the format section."""
+    output = "packet,0.000000,K__\npacket,0.040000,___\npacket,2.000000,K__\nformat,4.500000\n"
+    assert _parse_probe_output(output) == (4.5, [0.0, 2.0])
+
+
+def test_keyframes_are_sorted():
+    """Packets are listed in decoding order, the keyframe times are returned sorted."""
+    output = "packet,4.000000,K__\npacket,0.000000,K__\npacket,2.000000,K_D\nformat,6.0\n"
+    assert _parse_probe_output(output) == (6.0, [0.0, 2.0, 4.0])
+
+
+def test_na_fields_are_skipped():
+    """Packets without a timestamp and a file without a duration report N/A."""
+    output = "packet,N/A,K__\npacket,1.000000,K__\nformat,N/A\n"
+    assert _parse_probe_output(output) == (0.0, [1.0])
+
+
+def test_empty_fields_are_skipped():
+    """Empty timestamps and durations are ignored."""
+    output = "packet,,K__\npacket,1.000000,K__\npacket\nformat,\n"
+    assert _parse_probe_output(output) == (0.0, [1.0])
+
+
+def test_empty_output():
+    """No output gives no duration and no keyframes."""
+    assert _parse_probe_output("") == (0.0, [])
@@ -0,0 +1,49 @@
+"""
+Tests for the pooled PSNR computed from libvmaf logs.
+"""
+
+import pytest
+
+from encodex.vmaf import PSNR_MAX_DB, pooled_psnr
+
+
+def _frame(psnr_y, psnr_cb=None, psnr_cr=None):
+    """Build a libvmaf log frame with the given per-plane PSNR (chroma defaults to the luma value)."""
+    return {
+        "metrics": {
+            "psnr_y": psnr_y,
+            "psnr_cb": psnr_y if psnr_cb is None else psnr_cb,
+            "psnr_cr": psnr_y if psnr_cr is None else psnr_cr,
+        }
+    }
+
+
+def test_constant_psnr():
+    """Frames with the same PSNR on every plane pool to that PSNR."""
+    assert pooled_psnr({"frames": [_frame(40.0), _frame(40.0)]}) == pytest.approx(40.0)
+
+
+def test_frames_are_averaged_in_the_mse_domain():
+    """The MSE is averaged over the frames, not the PSNR, so bad frames weigh more than the mean of the dB values."""
+    assert pooled_psnr({"frames": [_frame(30.0), _frame(50.0)]}) == pytest.approx(32.967086, abs=1e-6)
+
+
+def test_planes_are_weighted_by_size():
+    """For 4:2:0 video luma has four times the samples of each chroma plane."""
+    assert pooled_psnr({"frames": [_frame(30.0, 60.0, 60.0)]}) == pytest.approx(31.758742, abs=1e-6)
+
+
+def test_psnr_is_capped():
+    """Near-identical frames are capped at the maximum PSNR libvmaf reports."""
+    assert pooled_psnr({"frames": [_frame(80.0)]}) == PSNR_MAX_DB
+
+
+def test_no_frames():
+    """A log without frames has no PSNR."""
+    assert pooled_psnr({"frames": []}) is None
+
+
+def test_incomplete_frames_fall_back_to_pooled_luma():
+    """Without per-plane values the pooled luma PSNR of the log is used."""
+    vmaf_data = {"frames": [{"metrics": {"psnr_y": 40.0}}], "pooled_metrics": {"psnr_y": {"mean": 41.5}}}
+    assert pooled_psnr(vmaf_data) == 41.5